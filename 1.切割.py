@@ -1,14 +1,9 @@
 import os
+from chunker import split_file
 
 def process_file(file_path):
-    """处理单个文件，按空行切割"""
-    with open(file_path, encoding='utf-8', mode='r') as fp:
-        data = fp.read()
-    
-    # 根据换行切割
-    chunk_list = data.split("\n\n")
-    chunk_list = [chunk for chunk in chunk_list if chunk]
-    return chunk_list
+    """处理单个文件，按标题和长度切割，返回 [{'text', 'headings'}, ...]"""
+    return split_file(file_path)
 
 def process_all_files():
     """处理knowledge文件夹中的所有txt文件"""
@@ -33,4 +28,4 @@ if __name__ == "__main__":
     # 打印前3个片段作为示例
     print("\n前3个片段示例:")
     for i, chunk in enumerate(all_chunks[:3]):
-        print(f"片段 {i+1}:\n{chunk}\n{'-'*50}")
\ No newline at end of file
+        print(f"片段 {i+1} ({' > '.join(chunk['headings']) or '无标题'}):\n{chunk['text']}\n{'-'*50}")
\ No newline at end of file
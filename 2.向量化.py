@@ -1,25 +1,11 @@
-import requests
 import os
-
-def get_embedding(text):
-    """获取单个文本的向量表示"""
-    res = requests.post(
-        url="http://127.0.0.1:11434/api/embeddings",
-        json={
-            "model": "nomic-embed-text",
-            "prompt": text
-        }
-    )
-    return res.json()['embedding']
+from itertools import islice
+from ollama_client import embed_texts
+from chunker import iter_file_chunks
 
 def process_file(file_path):
-    """处理单个文件，按空行切割"""
-    with open(file_path, encoding='utf-8', mode='r') as fp:
-        data = fp.read()
-    
-    # 根据换行切割
-    chunk_list = data.split("\n\n")
-    return [chunk for chunk in chunk_list if chunk]
+    """处理单个文件，按标题和长度流式切割，逐个返回 {'text', 'headings'}"""
+    return iter_file_chunks(file_path)
 
 def vectorize_all_files():
     """处理knowledge文件夹中的所有txt文件并进行向量化"""
@@ -32,11 +18,12 @@ def vectorize_all_files():
         if filename.endswith(".txt"):
             file_path = os.path.join(knowledge_dir, filename)
             print(f"处理文件: {filename}")
-            chunks = process_file(file_path)
+            chunks = [chunk['text'] for chunk in islice(process_file(file_path), 2)]  # 为了演示，只处理每个文件的前2个片段（只读取文件开头）
             
-            for chunk in chunks[:2]:  # 为了演示，只处理每个文件的前2个片段
+            # 同一文件的片段一次批量向量化
+            embeddings = embed_texts(chunks)
+            for chunk, embedding in zip(chunks, embeddings):
                 print(f"\n处理文本片段:\n{chunk[:100]}...")
-                embedding = get_embedding(chunk)
                 all_vectors.append(embedding)
                 all_texts.append(chunk)
                 print(f"向量维度: {len(embedding)}")
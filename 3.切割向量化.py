@@ -1,58 +1,52 @@
-import requests
 import os
+from itertools import islice
+from ollama_client import embed_texts
+from ingestion import iter_chunked_files, embed_in_parallel
+from chunker import iter_file_chunks
 
 def process_file(file_path):
-    """处理单个文件，按空行切割"""
-    with open(file_path, encoding='utf-8', mode='r') as fp:
-        data = fp.read()
-    
-    # 根据换行切割
-    chunk_list = data.split("\n\n")
-    return [chunk for chunk in chunk_list if chunk]
+    """处理单个文件，按标题和长度流式切割，逐个返回 {'text', 'headings'}"""
+    return iter_file_chunks(file_path)
 
-def ollama_embedding_by_api(text):
-    """通过Ollama API获取文本的向量表示"""
-    res = requests.post(
-        url="http://127.0.0.1:11434/api/embeddings",
-        json={
-            "model": "nomic-embed-text",
-            "prompt": text
-        }
-    )
-    embedding = res.json()['embedding']
-    return embedding
+def embed_file_chunks(chunks):
+    """向量化一个文件的片段，失败时返回空列表"""
+    try:
+        return embed_texts(chunks)
+    except Exception as e:
+        print(f"向量化失败: {e}")
+        return []
 
 def process_all_files():
-    """处理knowledge文件夹中的所有txt文件并进行向量化"""
+    """处理knowledge文件夹中的所有txt文件并进行向量化
+
+    文件在进程池中并行切割，各文件的向量化请求并发发送，结果仍按文件顺序输出。
+    """
     knowledge_dir = "knowledge"
     all_chunks_with_vectors = []
     
-    # 遍历knowledge文件夹中的所有txt文件
-    for filename in os.listdir(knowledge_dir):
-        if filename.endswith(".txt"):
-            file_path = os.path.join(knowledge_dir, filename)
+    # knowledge文件夹中的所有txt文件
+    filenames = [f for f in os.listdir(knowledge_dir) if f.endswith(".txt")]
+    
+    def file_batches():
+        for filename, records in iter_chunked_files(knowledge_dir, filenames, process_file):
             print(f"\n处理文件: {filename}")
-            chunks = process_file(file_path)
-            print(f"该文件切割成 {len(chunks)} 个片段")
-            
-            for i, chunk in enumerate(chunks):
-                # 为了演示，限制每个文件处理的片段数量
-                if i >= 2:  # 每个文件只处理前2个片段
-                    break
-                
-                print(f"\n处理片段 {i+1}:")
-                print(f"文本内容: {chunk[:80]}...")
-                try:
-                    vector = ollama_embedding_by_api(chunk)
-                    all_chunks_with_vectors.append({
-                        "filename": filename,
-                        "chunk_index": i,
-                        "text": chunk,
-                        "vector": vector
-                    })
-                    print(f"向量维度: {len(vector)}")
-                except Exception as e:
-                    print(f"向量化失败: {e}")
+            # 为了演示，每个文件只处理前2个片段；records可能是生成器，其余片段只计数
+            records = iter(records)
+            chunks = [record['document'] for record in islice(records, 2)]
+            print(f"该文件切割成 {len(chunks) + sum(1 for _ in records)} 个片段")
+            yield chunks, (filename, chunks)
+    
+    for (filename, chunks), vectors in embed_in_parallel(file_batches(), embed_fn=embed_file_chunks):
+        for i, (chunk, vector) in enumerate(zip(chunks, vectors)):
+            print(f"\n处理片段 {i+1} ({filename}):")
+            print(f"文本内容: {chunk[:80]}...")
+            all_chunks_with_vectors.append({
+                "filename": filename,
+                "chunk_index": i,
+                "text": chunk,
+                "vector": vector
+            })
+            print(f"向量维度: {len(vector)}")
     
     return all_chunks_with_vectors
 
@@ -1,92 +1,23 @@
-import chromadb
-import uuid
-import requests
-import os
-
-def ollama_embedding_by_api(text):
-    """通过Ollama API获取文本的向量表示"""
-    res = requests.post(
-        url="http://127.0.0.1:11434/api/embeddings",
-        json={
-            "model": "nomic-embed-text",
-            "prompt": text
-        }
-    )
-    embedding = res.json()['embedding']
-    return embedding
+import vector_store
+from ollama_client import embed_text
+from ingestion import sync_collection
+from chunker import iter_file_chunks
 
 def process_file(file_path):
-    """处理单个文件，按空行切割"""
-    with open(file_path, encoding='utf-8', mode='r') as fp:
-        data = fp.read()
-    
-    # 根据换行切割
-    chunk_list = data.split("\n\n")
-    return [chunk for chunk in chunk_list if chunk]
+    """处理单个文件，按标题和长度流式切割，逐个返回 {'text', 'headings'}"""
+    return iter_file_chunks(file_path)
 
 def load_all_files_to_db():
-    """加载knowledge文件夹中的所有txt文件到Chroma数据库"""
-    # 初始化数据库连接
-    client = chromadb.PersistentClient(path="db/chroma_demo")
-    
+    """将knowledge文件夹中的所有txt文件增量同步到向量数据库（后端由VECTOR_BACKEND决定）"""
     # 创建或获取集合
     collection_name = "all_knowledge_collection"
-    collection = client.get_or_create_collection(name=collection_name)
-    
-    # 清空集合，重新加载
-    collection.delete(where={"source": "knowledge_files"})  # 删除之前的文档
-    
-    knowledge_dir = "knowledge"
-    documents = []
-    ids = []
-    embeddings = []
-    metadatas = []
-    
-    print(f"开始处理knowledge文件夹中的文件并加载到数据库...")
+    collection = vector_store.get_collection(collection_name)
     
-    # 遍历knowledge文件夹中的所有txt文件
-    for filename in os.listdir(knowledge_dir):
-        if filename.endswith(".txt"):
-            file_path = os.path.join(knowledge_dir, filename)
-            print(f"处理文件: {filename}")
-            chunks = process_file(file_path)
-            print(f"该文件切割成 {len(chunks)} 个片段")
-            
-            for i, chunk in enumerate(chunks):
-                # 生成唯一ID
-                doc_id = str(uuid.uuid4())
-                
-                try:
-                    # 获取向量
-                    embedding = ollama_embedding_by_api(chunk)
-                    
-                    # 添加到列表
-                    documents.append(chunk)
-                    ids.append(doc_id)
-                    embeddings.append(embedding)
-                    metadatas.append({
-                        "source": "knowledge_files",
-                        "filename": filename,
-                        "chunk_index": i
-                    })
-                    
-                    print(f"处理片段 {i+1}/{len(chunks)}")
-                    
-                except Exception as e:
-                    print(f"处理片段 {i+1} 失败: {e}")
+    print(f"开始同步knowledge文件夹中的文件到数据库...")
     
-    # 批量插入到数据库
-    if documents:
-        print(f"\n准备插入 {len(documents)} 个文档到数据库...")
-        collection.add(
-            ids=ids,
-            documents=documents,
-            embeddings=embeddings,
-            metadatas=metadatas
-        )
-        print(f"成功插入 {len(documents)} 个文档到数据库")
-    else:
-        print("没有找到文档需要插入")
+    # 片段ID由文件名和内容哈希确定，只写入新增片段、删除已不存在的片段
+    stats = sync_collection(collection, "knowledge", process_file)
+    print(f"同步完成，数据库中共有 {collection.count()} 个片段")
     
     return collection
 
@@ -94,12 +25,11 @@ def query_knowledge(query_text, collection):
     """查询知识库"""
     print(f"\n查询: {query_text}")
     # 获取查询向量
-    query_embedding = ollama_embedding_by_api(query_text)
+    query_embedding = embed_text(query_text)
     
     # 执行查询
     results = collection.query(
         query_embeddings=[query_embedding],
-        query_texts=[query_text],
         n_results=3
     )
     
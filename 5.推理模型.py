@@ -1,63 +1,58 @@
-import requests
-import chromadb
+import semantic_cache
+from context_builder import build_context
+from ollama_client import embed_text, generate_stream
+from retriever import search
 
-def ollama_embedding_by_api(text):
-    """通过Ollama API获取文本的向量表示"""
-    res = requests.post(
-        url="http://127.0.0.1:11434/api/embeddings",
-        json={
-            "model": "nomic-embed-text",
-            "prompt": text
-        }
-    )
-    embedding = res.json()['embedding']
-    return embedding
+# 知识库集合
+COLLECTION_NAME = "all_knowledge_collection"
 
-def ollama_generate_by_api(prompt, model="deepseek-r1:1.5b", temperature=0.1):
-    """通过Ollama API生成文本回复"""
-    response = requests.post(
-        url="http://127.0.0.1:11434/api/generate",
-        json={
-            "model": model,
-            "prompt": prompt,
-            "stream": False,
-            "temperature": temperature
-        }
-    )
-    return response.json()['response']
-
-def query_knowledge_base(query_text, n_results=3):
-    """查询知识库获取相关信息"""
+def query_knowledge_base(query_text, n_results=3, query_embedding=None):
+    """查询知识库获取相关信息，已有查询向量时不再重复向量化"""
     try:
-        # 连接到Chroma数据库
-        client = chromadb.PersistentClient(path="db/chroma_demo")
-        collection = client.get_collection(name="all_knowledge_collection")
-        
-        # 获取查询向量
-        query_embedding = ollama_embedding_by_api(query_text)
-        
-        # 执行查询
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_results
-        )
-        
-        return results['documents'][0], results['metadatas'][0]
+        # 复用已打开的数据库连接和集合，每次查询只需向量化和近邻搜索
+        if query_embedding is None:
+            query_embedding = embed_text(query_text)
+        hits = search(query_embedding, n_results, collection_name=COLLECTION_NAME)
+        return [hit['document'] for hit in hits], [hit['metadata'] for hit in hits]
     except Exception as e:
         print(f"查询知识库失败: {e}")
         return [], []
 
+def lookup_cached_response(query_text):
+    """在语义缓存中查找相似的问题，返回 (查询向量, 命中的缓存)，向量化失败时返回 (None, None)"""
+    try:
+        query_embedding = embed_text(query_text)
+    except Exception as e:
+        print(f"查询向量化失败: {e}")
+        return None, None
+    return query_embedding, semantic_cache.get_cache(COLLECTION_NAME).lookup(query_embedding)
+
 def generate_response(query_text, use_knowledge=True):
     """生成回复，可选是否使用知识库"""
     print(f"\n查询: {query_text}")
     
+    query_embedding = None
+    sources_info = ""
     if use_knowledge:
+        # 相似的问题已回答过时直接返回缓存的回复，不再检索和调用模型
+        query_embedding, cached = lookup_cached_response(query_text)
+        if cached:
+            print(f"\n命中语义缓存 (相似度: {cached['similarity']:.4f}，原问题: {cached['query']})")
+            if cached['value']['sources_info']:
+                print("\n已从知识库获取相关信息:")
+                print(cached['value']['sources_info'])
+            print(f"\n回复:")
+            print(cached['value']['response'])
+            return cached['value']['response']
+        
         # 从知识库获取相关信息
-        relevant_docs, metadatas = query_knowledge_base(query_text)
+        relevant_docs, metadatas = [], []
+        if query_embedding is not None:
+            relevant_docs, metadatas = query_knowledge_base(query_text, query_embedding=query_embedding)
         
         if relevant_docs:
-            # 构建上下文
-            context = "\n".join(relevant_docs)
+            # 构建上下文：在token预算内保留与问题最相关的句子
+            context = build_context(query_text, relevant_docs)
             sources_info = "\n".join([f"来源: {m['filename']}, 片段 {m['chunk_index']+1}" for m in metadatas])
             
             # 构建带上下文的提示词
@@ -75,15 +70,26 @@ def generate_response(query_text, use_knowledge=True):
         # 不使用知识库，直接回答
         prompt = f"""请用中文回答用户问题: {query_text}\n"""
     
-    # 生成回复
+    # 流式生成回复，边生成边输出
     try:
-        response = ollama_generate_by_api(prompt)
         print(f"\n回复:")
-        print(response)
-        return response
+        parts = []
+        for text in generate_stream(prompt):
+            parts.append(text)
+            print(text, end="", flush=True)
+        print()
+        response = "".join(parts)
     except Exception as e:
         print(f"生成回复失败: {e}")
         return "抱歉，我暂时无法回答这个问题。"
+    
+    # 只缓存使用知识库时成功生成的回复
+    if query_embedding is not None:
+        semantic_cache.get_cache(COLLECTION_NAME).store(query_text, query_embedding, {
+            'sources_info': sources_info,
+            'response': response
+        })
+    return response
 
 if __name__ == "__main__":
     # 测试不同类型的查询
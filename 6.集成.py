@@ -1,143 +1,74 @@
-import uuid
-import chromadb
-import requests
-import os
+import vector_store
+import semantic_cache
+from context_builder import build_context
+from ollama_client import embed_text, generate_stream
+from ingestion import sync_collection
+from chunker import iter_file_chunks
 
 def process_file(file_path):
-    """处理单个文件，按空行切割"""
-    with open(file_path, encoding='utf-8', mode='r') as fp:
-        data = fp.read()
-    
-    # 根据换行切割
-    chunk_list = data.split("\n\n")
-    return [chunk for chunk in chunk_list if chunk]
-
-def ollama_embedding_by_api(text):
-    """通过Ollama API获取文本的向量表示"""
-    res = requests.post(
-        url="http://127.0.0.1:11434/api/embeddings",
-        json={
-            "model": "nomic-embed-text",
-            "prompt": text
-        }
-    )
-    embedding = res.json()['embedding']
-    return embedding
-
-def ollama_generate_by_api(prompt, model="deepseek-r1:1.5b", temperature=0.1):
-    """通过Ollama API生成文本回复"""
-    response = requests.post(
-        url="http://127.0.0.1:11434/api/generate",
-        json={
-            "model": model,
-            "prompt": prompt,
-            "stream": False,
-            "temperature": temperature
-        }
-    )
-    return response.json()['response']
+    """处理单个文件，按标题和长度流式切割，逐个返回 {'text', 'headings'}"""
+    return iter_file_chunks(file_path)
 
-def initialize_knowledge_base(collection_name="integrated_knowledge_collection"):
-    """初始化知识库，处理knowledge文件夹中的所有文件"""
+def initialize_knowledge_base(collection_name="integrated_knowledge_collection", rebuild=False):
+    """初始化知识库，将knowledge文件夹中的所有文件增量同步到集合；rebuild为True时删除集合后重建"""
     print("=== 初始化知识库 ===")
     
-    # 连接数据库
-    client = chromadb.PersistentClient(path="db/chroma_demo")
+    # 向量库后端由VECTOR_BACKEND决定（chroma或numpy）
+    if rebuild:
+        print(f"重置集合: {collection_name}")
+        vector_store.delete_collection(collection_name)
     
-    # 创建或重置集合
-    print(f"创建/重置集合: {collection_name}")
-    try:
-        client.delete_collection(collection_name)
-    except:
-        pass  # 集合可能不存在，忽略错误
-    
-    collection = client.get_or_create_collection(name=collection_name)
+    collection = vector_store.get_collection(collection_name)
     
-    # 处理所有文件
-    knowledge_dir = "knowledge"
-    documents = []
-    ids = []
-    embeddings = []
-    metadatas = []
-    
-    # 获取knowledge文件夹中的所有txt文件
-    txt_files = [f for f in os.listdir(knowledge_dir) if f.endswith(".txt")]
-    print(f"找到 {len(txt_files)} 个文本文件")
-    
-    total_chunks = 0
-    # 处理每个文件
-    for filename in txt_files:
-        file_path = os.path.join(knowledge_dir, filename)
-        print(f"\n处理文件: {filename}")
-        
-        # 切割文件
-        chunks = process_file(file_path)
-        print(f"该文件切割成 {len(chunks)} 个片段")
-        total_chunks += len(chunks)
-        
-        # 处理每个片段
-        for i, chunk in enumerate(chunks):
-            try:
-                # 生成唯一ID
-                doc_id = str(uuid.uuid4())
-                
-                # 获取向量
-                embedding = ollama_embedding_by_api(chunk)
-                
-                # 添加到列表
-                documents.append(chunk)
-                ids.append(doc_id)
-                embeddings.append(embedding)
-                metadatas.append({
-                    "source": "knowledge_files",
-                    "filename": filename,
-                    "chunk_index": i
-                })
-                
-                # 显示进度
-                if (i + 1) % 5 == 0 or i + 1 == len(chunks):
-                    print(f"  已处理 {i + 1}/{len(chunks)} 个片段")
-                    
-            except Exception as e:
-                print(f"  处理片段 {i+1} 失败: {e}")
-    
-    # 批量插入到数据库
-    if documents:
-        print(f"\n准备插入 {len(documents)} 个文档到数据库...")
-        collection.add(
-            ids=ids,
-            documents=documents,
-            embeddings=embeddings,
-            metadatas=metadatas
-        )
-        print(f"成功插入 {len(documents)} 个文档到数据库")
-        print(f"总共处理了 {len(txt_files)} 个文件，{total_chunks} 个片段")
-    else:
-        print("没有找到文档需要插入")
+    # 片段ID由文件名和内容哈希确定，只处理新增、删除和位置变化的片段
+    stats = sync_collection(collection, "knowledge", process_file)
+    print(f"新增 {stats['added']} 个，删除 {stats['deleted']} 个，更新 {stats['updated']} 个，"
+          f"集合中共有 {collection.count()} 个片段")
     
     return collection
 
-def retrieve_from_knowledge_base(query_text, collection, n_results=3):
-    """从知识库中检索相关信息"""
+def retrieve_from_knowledge_base(query_text, collection, n_results=3, query_embedding=None):
+    """从知识库中检索相关信息，已有查询向量时不再重复向量化"""
     # 获取查询向量
-    query_embedding = ollama_embedding_by_api(query_text)
+    if query_embedding is None:
+        query_embedding = embed_text(query_text)
     
     # 执行查询
     results = collection.query(
         query_embeddings=[query_embedding],
-        query_texts=[query_text],
         n_results=n_results
     )
     
     return results
 
+def show_relevant_docs(relevant_docs, distances, metadatas):
+    """显示检索到的信息"""
+    print(f"\n=== 检索到的相关信息 ===")
+    for i, (doc, dist, meta) in enumerate(zip(relevant_docs, distances, metadatas)):
+        print(f"\n相关文档 {i+1} (相似度: {1-dist:.4f}):")
+        print(f"来源: {meta['filename']}, 片段 {meta['chunk_index']+1}")
+        print(f"内容预览: {doc[:150]}..." if len(doc) > 150 else f"内容: {doc}")
+
 def generate_answer(query_text, collection):
-    """根据查询生成回答"""
+    """根据查询生成回答，相似的问题已回答过时直接返回缓存的检索结果和回答"""
     print(f"\n=== 用户查询 ===")
     print(f"问题: {query_text}")
     
+    # 获取查询向量，先在语义缓存中查找相似的问题
+    query_embedding = embed_text(query_text)
+    cache = semantic_cache.get_cache(collection.name)
+    cached = cache.lookup(query_embedding)
+    if cached:
+        value = cached['value']
+        print(f"\n命中语义缓存 (相似度: {cached['similarity']:.4f}，原问题: {cached['query']})")
+        if value['documents']:
+            show_relevant_docs(value['documents'], value['distances'], value['metadatas'])
+        print("\n=== 生成回答 ===")
+        print(value['answer'])
+        return value['answer']
+    
     # 从知识库检索相关信息
-    results = retrieve_from_knowledge_base(query_text, collection)
+    results = retrieve_from_knowledge_base(query_text, collection, query_embedding=query_embedding)
     
     # 提取相关文档
     relevant_docs = results['documents'][0]
@@ -145,15 +76,11 @@ def generate_answer(query_text, collection):
     distances = results['distances'][0]
     
     if relevant_docs:
-        # 构建上下文
-        context = "\n".join(relevant_docs)
+        # 构建上下文：在token预算内保留与问题最相关的句子
+        context = build_context(query_text, relevant_docs)
         
         # 显示检索到的信息
-        print(f"\n=== 检索到的相关信息 ===")
-        for i, (doc, dist, meta) in enumerate(zip(relevant_docs, distances, metadatas)):
-            print(f"\n相关文档 {i+1} (相似度: {1-dist:.4f}):")
-            print(f"来源: {meta['filename']}, 片段 {meta['chunk_index']+1}")
-            print(f"内容预览: {doc[:150]}..." if len(doc) > 150 else f"内容: {doc}")
+        show_relevant_docs(relevant_docs, distances, metadatas)
         
         # 构建提示词
         prompt = f"""你是一个专业的助手，任务是根据提供的参考信息回答用户问题。
@@ -172,16 +99,28 @@ def generate_answer(query_text, collection):
 回答:
 """
     
-    # 生成回答
+    # 流式生成回答，边生成边输出
     try:
         print("\n=== 生成回答 ===")
-        answer = ollama_generate_by_api(prompt)
-        print(answer)
-        return answer
+        parts = []
+        for text in generate_stream(prompt):
+            parts.append(text)
+            print(text, end="", flush=True)
+        print()
+        answer = "".join(parts)
     except Exception as e:
         error_msg = f"生成回答失败: {e}"
         print(error_msg)
         return error_msg
+    
+    # 只缓存成功生成的回答
+    cache.store(query_text, query_embedding, {
+        'documents': relevant_docs,
+        'metadatas': metadatas,
+        'distances': distances,
+        'answer': answer
+    })
+    return answer
 
 def main():
     """主函数"""
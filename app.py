@@ -1,19 +1,93 @@
 import os
 import re
 import json
-from flask import Flask, render_template, request, jsonify
+import heapq
+import gc
+import hashlib
+import mmap
+import multiprocessing
+import pickle
+import shutil
+import threading
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+import jieba
+import numpy as np
+from scipy import sparse
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+from ollama_client import generate_stream
+from context_builder import build_context
 
 app = Flask(__name__)
 
-# 知识库存储
+# 知识库快照：知识库内容及其全部索引，构建完成后整体替换，查询过程中只读不改
+#   knowledge_base: 标题 -> {'file', 'content', 'doc'}
+#   line_index: 行级倒排索引，词项（行内相邻两个字符）-> {知识库标题: [行号, ...]}
+#   bm25_index: BM25稀疏矩阵索引，第一次bm25检索时构建（bm25为默认检索模式时在重建过程中构建），之前为None
+#   manifest: 文件名 -> {'size': 大小, 'mtime': 修改时间, 'hash': 内容哈希}，用于增量加载
+#   version: 快照版本号，每次替换加一
+knowledge_snapshot = {'knowledge_base': {}, 'line_index': {}, 'bm25_index': None, 'manifest': {}, 'version': 0}
+
+# 持久化快照目录：启动时直接加载解析结果和索引，避免重新读取和解析所有文件
+#   index.pkl: 版本、文件清单以及各文件记录的位置，最后写入
+#   files/<记录名>.pkl: 单个文件的解析结果，记录名由标题和内容哈希确定，文件未修改时不再重写
+#   bm25/<词表ID>/<记录名>.pkl: 单个文件的BM25词频矩阵
+#   line_index.<快照版本号>.pkl: 行级倒排索引
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), 'db', 'knowledge_snapshot')
+# 快照格式版本，解析或索引结构变化时需要递增
+SNAPSHOT_FORMAT_VERSION = 3
+# 等待写入磁盘的快照，写入在后台线程中进行，不阻塞快照发布
+snapshot_save_pending = None
+snapshot_save_thread = None
+snapshot_save_lock = threading.Lock()
+
+# 知识库存储（指向当前快照中的内容）
 knowledge_base = {}
 knowledge_initialized = False
 
+# 后台重建状态，由/api/init/status返回
+rebuild_status = {'state': 'idle', 'processed': 0, 'total': 0, 'message': '', 'started_at': None, 'finished_at': None}
+rebuild_status_lock = threading.Lock()
+# 同一时间只允许一个重建任务
+rebuild_lock = threading.Lock()
+
+# 检索模式：keyword为原有的关键词规则匹配，bm25为基于jieba分词的BM25稀疏矩阵检索
+RETRIEVAL_MODES = ('keyword', 'bm25')
+RETRIEVAL_MODE = os.environ.get('RETRIEVAL_MODE', 'keyword')
+# 构建BM25索引的锁，避免多个查询同时为同一快照构建
+bm25_lock = threading.Lock()
+# 最近一次构建的BM25索引：其词表和各文件的词频矩阵作为下一次构建的基础
+latest_bm25_index = None
+
+# 跨文件保留的最相关段落数量
+TOP_K_SECTIONS = 3
+# 批量问答接口单次允许的最大问题数
+MAX_BATCH_QUERIES = 1000
+
+# 并行打分：PARALLEL_WORKERS为进程池大小，0表示在当前进程中串行打分；实际进程数不超过CPU核数，不足2个时串行
+PARALLEL_WORKERS = int(os.environ.get('PARALLEL_WORKERS', '0'))
+# 待打分文件少于该数量时仍然串行：单个文件打分约0.3~0.6毫秒，一次进程池往返约1毫秒，
+# 文件较少时并行节省的时间抵不过通信开销
+PARALLEL_MIN_FILES = int(os.environ.get('PARALLEL_MIN_FILES', '32'))
+# 工作进程的启动方式：主进程中还有请求线程和后台重建线程，fork可能复制其他线程持有的锁，
+# 因此优先使用forkserver，不支持时使用spawn
+SCORING_MP_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+# (快照版本号, 进程池)，进程池为None表示正在后台创建
+scoring_pool = None
+scoring_pool_lock = threading.Lock()
+
+# 停用词与特殊关键词
+STOP_WORDS = {'的', '了', '在', '是', '我', '有', '和', '就', '不', '人', '都', '一', '一个', '上', '也', '很', '到', '说', '要', '去', '你', '会', '着', '没有', '看', '好', '自己', '这'}
+SPECIAL_KEYWORDS = {'毕业', '条件', '学位', '学分', '修业', '年限'}
+
 # 读取知识库文件
 def load_knowledge_file(file_path):
-    """从文件中加载知识库内容"""
+    """从文件中加载知识库内容（关键词索引需要全文）；utf-8-sig编码会去掉web_scraper.py写入的BOM"""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
+        with open(file_path, 'r', encoding='utf-8-sig') as f:
             content = f.read()
         return content
     except Exception as e:
@@ -21,52 +95,779 @@ def load_knowledge_file(file_path):
         return ""
 
 # 初始化知识库
-def initialize_knowledge():
-    """初始化所有知识库文件"""
-    global knowledge_base, knowledge_initialized
-    knowledge_base = {}
-    
+def initialize_knowledge(full_rebuild=False):
+    """初始化所有知识库文件
+
+    基于当前快照增量构建新快照（只重新解析新增、修改和删除的文件），构建完成后整体替换，
+    构建期间查询继续使用旧快照。full_rebuild为True时全部重建。
+    """
+    global knowledge_snapshot, knowledge_base, knowledge_initialized, latest_bm25_index
+
     # 知识库文件夹路径
     knowledge_dir = os.path.join(os.path.dirname(__file__), 'knowledge')
     
     # 检查知识库文件夹是否存在
     if not os.path.exists(knowledge_dir):
         print(f"知识库文件夹不存在: {knowledge_dir}")
+        update_rebuild_status(state='error', message=f"知识库文件夹不存在: {knowledge_dir}", finished_at=time.time())
         return False
-    
-    # 读取所有txt文件
-    for filename in os.listdir(knowledge_dir):
-        if filename.endswith('.txt'):
-            file_path = os.path.join(knowledge_dir, filename)
-            content = load_knowledge_file(file_path)
-            if content:
-                # 使用文件名作为知识库标题
-                title = os.path.splitext(filename)[0]
-                knowledge_base[title] = {
-                    'file': filename,
-                    'content': content
-                }
-                print(f"成功加载知识库: {title}")
-    
-    knowledge_initialized = len(knowledge_base) > 0
+
+    with rebuild_lock:
+        update_rebuild_status(state='running', processed=0, total=0, message='正在扫描知识库文件夹',
+                              started_at=time.time(), finished_at=None)
+        try:
+            previous = knowledge_snapshot
+            # 首次加载时优先使用磁盘上的快照，之后只需增量处理变化的文件
+            if not previous['manifest'] and not full_rebuild:
+                previous = load_persisted_snapshot() or previous
+            if full_rebuild:
+                # 全部重建时不复用之前的分词结果，词表也重新开始
+                with bm25_lock:
+                    latest_bm25_index = None
+            snapshot = build_knowledge_snapshot(knowledge_dir, previous, full_rebuild)
+            # bm25为默认检索模式时在发布快照前构建，只需对变化的文件分词；否则等到第一次bm25检索时再构建
+            if RETRIEVAL_MODE == 'bm25' and snapshot['bm25_index'] is None:
+                update_rebuild_status(message='正在构建BM25索引')
+                get_bm25_index(snapshot, previous['bm25_index'])
+        except Exception as e:
+            update_rebuild_status(state='error', message=f"知识库构建失败: {str(e)}", finished_at=time.time())
+            raise
+
+        # 整体替换快照引用，正在进行的查询仍持有旧快照
+        knowledge_snapshot = snapshot
+        knowledge_base = snapshot['knowledge_base']
+        knowledge_initialized = len(knowledge_base) > 0
+        update_rebuild_status(state='done', message=f"知识库已更新，共 {len(knowledge_base)} 个文件",
+                              finished_at=time.time())
+
+        # 快照有变化时在后台写回磁盘，发布不等待写入完成；在锁内登记，保证按发布顺序写入
+        if snapshot is not previous:
+            schedule_snapshot_save(snapshot)
     return knowledge_initialized
 
+def build_knowledge_snapshot(knowledge_dir, previous, full_rebuild=False):
+    """扫描知识库文件夹，基于上一个快照构建新快照，不修改上一个快照的任何内容"""
+    if full_rebuild or not previous['manifest']:
+        kb, index, manifest = {}, {}, {}
+        # 全新构建的索引没有旧快照共享，可以直接修改
+        fresh_terms = None
+    else:
+        # 浅拷贝外层字典，被修改的倒排列表在修改前复制（写时复制）
+        kb = dict(previous['knowledge_base'])
+        index = dict(previous['line_index'])
+        manifest = dict(previous['manifest'])
+        fresh_terms = set()
 
+    filenames = [filename for filename in os.listdir(knowledge_dir) if filename.endswith('.txt')]
+    update_rebuild_status(total=len(filenames), message='正在加载知识库文件')
 
-# 关键词匹配函数
-def find_relevant_content(query, knowledge_content, file_name):
-    """在知识库内容中查找与查询相关的部分，特别关注各级标题"""
+    # 对比文件清单，找出新增、修改和删除的文件
+    added, changed, removed = 0, 0, 0
+    manifest_changed = False
+    for processed, filename in enumerate(filenames, 1):
+        update_rebuild_status(processed=processed)
+        file_path = os.path.join(knowledge_dir, filename)
+        try:
+            stat = os.stat(file_path)
+        except OSError as e:
+            print(f"读取知识库文件失败 {file_path}: {str(e)}")
+            continue
+
+        # 大小和修改时间都没变，认为文件未修改
+        record = manifest.get(filename)
+        if record and record['size'] == stat.st_size and record['mtime'] == stat.st_mtime_ns:
+            continue
+
+        content = load_knowledge_file(file_path)
+        content_hash = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        manifest[filename] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': content_hash}
+        manifest_changed = True
+        # 只是修改时间变化，内容未变
+        if record and record['hash'] == content_hash:
+            continue
+
+        if record:
+            changed += 1
+        else:
+            added += 1
+        update_knowledge_file(kb, index, filename, content, fresh_terms)
+
+    current_files = set(filenames)
+    for filename in list(manifest):
+        if filename not in current_files:
+            removed += 1
+            del manifest[filename]
+            update_knowledge_file(kb, index, filename, "", fresh_terms)
+
+    print(f"知识库加载完成: 新增 {added} 个，修改 {changed} 个，删除 {removed} 个，共 {len(kb)} 个文件")
+    # 没有任何变化时继续使用上一个快照
+    if fresh_terms is not None and not (added or changed or removed or manifest_changed):
+        return previous
+
+    return {
+        'knowledge_base': kb,
+        'line_index': index,
+        # 文件内容没有变化时沿用上一个快照的BM25索引
+        'bm25_index': previous['bm25_index'] if not (added or changed or removed or fresh_terms is None) else None,
+        'manifest': manifest,
+        'version': previous['version'] + 1
+    }
+
+def update_knowledge_file(kb, index, filename, content, fresh_terms=None):
+    """用新内容替换知识库中的一个文件，并更新倒排索引；content为空时移除该文件"""
+    # 使用文件名作为知识库标题
+    title = os.path.splitext(filename)[0]
+
+    old = kb.get(title)
+    if old:
+        remove_knowledge_lines(index, title, old['doc'], fresh_terms)
+
+    if not content:
+        kb.pop(title, None)
+        return
+
+    doc = parse_document(content)
+    kb[title] = {
+        'file': filename,
+        'content': content,
+        'doc': doc
+    }
+    # 加入行级倒排索引，查询时只需扫描候选行
+    index_knowledge_lines(index, title, doc, fresh_terms)
+    print(f"成功加载知识库: {title}")
+
+# 快照持久化
+def snapshot_signature():
+    """快照对应的解析配置签名，标题规则或停用词变化后旧快照失效"""
+    config = repr((SNAPSHOT_FORMAT_VERSION, [(p.pattern, level) for p, level in TITLE_PATTERNS],
+                   sorted(STOP_WORDS), jieba.__version__))
+    return hashlib.sha1(config.encode('utf-8')).hexdigest()
+
+def snapshot_record_name(title, content_hash):
+    """单个文件在快照目录中的记录名，由标题和内容哈希确定"""
+    return hashlib.sha1(f"{title}\0{content_hash}".encode('utf-8')).hexdigest()
+
+def write_snapshot_record(path, value, overwrite=False):
+    """将一个对象写入快照目录，先写临时文件再原子替换；overwrite为False时已存在的记录不再重写"""
+    if not overwrite and os.path.exists(path):
+        return
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def read_snapshot_record(path):
+    """读取快照目录中的一个对象，文件内容映射到内存后直接反序列化"""
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return pickle.loads(mapped)
+
+def save_persisted_snapshot(snapshot, directory=SNAPSHOT_DIR):
+    """将快照写入磁盘目录：各文件的解析结果和BM25词频按文件保存，只写入新增和修改的文件；
+    行索引和索引文件每次重写，索引文件最后原子替换，之后删除不再引用的记录"""
+    try:
+        files_dir = os.path.join(directory, 'files')
+        os.makedirs(files_dir, exist_ok=True)
+        records = {}
+        for title, knowledge in snapshot['knowledge_base'].items():
+            records[title] = snapshot_record_name(title, snapshot['manifest'][knowledge['file']]['hash'])
+            write_snapshot_record(os.path.join(files_dir, records[title] + '.pkl'), knowledge)
+
+        bm25 = snapshot['bm25_index']
+        bm25_meta = None
+        if bm25 is not None:
+            bm25_dir = os.path.join(directory, 'bm25', bm25['vocabulary_id'])
+            os.makedirs(bm25_dir, exist_ok=True)
+            for title, cached in bm25['files'].items():
+                write_snapshot_record(os.path.join(bm25_dir, records[title] + '.pkl'), cached)
+            # 词表可能正在被其他线程的增量构建追加，复制后再写入
+            with bm25_lock:
+                vocabulary = dict(bm25['vocabulary'])
+            bm25_meta = {'vocabulary_id': bm25['vocabulary_id'], 'vocabulary': vocabulary}
+
+        line_index_name = f"line_index.{snapshot['version']}.pkl"
+        write_snapshot_record(os.path.join(directory, line_index_name), snapshot['line_index'], overwrite=True)
+        meta = {
+            'format_version': SNAPSHOT_FORMAT_VERSION,
+            'signature': snapshot_signature(),
+            'version': snapshot['version'],
+            'manifest': snapshot['manifest'],
+            'records': records,
+            'line_index': line_index_name,
+            'bm25': bm25_meta
+        }
+        write_snapshot_record(os.path.join(directory, 'index.pkl'), meta, overwrite=True)
+        remove_stale_records(directory, meta)
+        print(f"知识库快照已保存: {directory}")
+    except Exception as e:
+        print(f"保存知识库快照失败 {directory}: {str(e)}")
+
+def remove_stale_records(directory, meta):
+    """删除索引文件不再引用的记录：已删除或修改的文件、旧词表的BM25词频和旧版本的行索引"""
+    keep = {name + '.pkl' for name in meta['records'].values()}
+    files_dir = os.path.join(directory, 'files')
+    for filename in os.listdir(files_dir):
+        if filename not in keep:
+            os.remove(os.path.join(files_dir, filename))
+
+    bm25_root = os.path.join(directory, 'bm25')
+    if os.path.isdir(bm25_root):
+        for vocabulary_id in os.listdir(bm25_root):
+            bm25_dir = os.path.join(bm25_root, vocabulary_id)
+            if meta['bm25'] is None or vocabulary_id != meta['bm25']['vocabulary_id']:
+                shutil.rmtree(bm25_dir, ignore_errors=True)
+                continue
+            for filename in os.listdir(bm25_dir):
+                if filename not in keep:
+                    os.remove(os.path.join(bm25_dir, filename))
+
+    for filename in os.listdir(directory):
+        if filename.startswith('line_index.') and filename != meta['line_index']:
+            os.remove(os.path.join(directory, filename))
+
+def schedule_snapshot_save(snapshot):
+    """在后台线程中将快照写入磁盘；写入期间又有新快照时只保留最新的一个，按发布顺序写入"""
+    global snapshot_save_pending, snapshot_save_thread
+    with snapshot_save_lock:
+        snapshot_save_pending = snapshot
+        if snapshot_save_thread is None:
+            # 非守护线程：进程退出前等待正在进行的写入完成
+            snapshot_save_thread = threading.Thread(target=run_snapshot_saves, name='snapshot-save')
+            snapshot_save_thread.start()
+
+def run_snapshot_saves():
+    """后台写入线程：依次写入等待中的快照，没有等待的快照时退出"""
+    global snapshot_save_pending, snapshot_save_thread
+    while True:
+        with snapshot_save_lock:
+            snapshot = snapshot_save_pending
+            snapshot_save_pending = None
+            if snapshot is None:
+                snapshot_save_thread = None
+                return
+        save_persisted_snapshot(snapshot)
+
+def load_persisted_snapshot(directory=SNAPSHOT_DIR):
+    """从磁盘目录加载快照；目录不存在、版本不符或记录缺失时返回None
+
+    已保存的BM25词表和各文件的词频矩阵作为下一次构建BM25索引的基础，构建时只需拼接矩阵，无需重新分词。
+    """
+    global latest_bm25_index
+    index_path = os.path.join(directory, 'index.pkl')
+    if not os.path.exists(index_path):
+        return None
+    # 反序列化会创建大量小对象，暂停垃圾回收可避免反复触发分代扫描
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        meta = read_snapshot_record(index_path)
+        if meta['format_version'] != SNAPSHOT_FORMAT_VERSION or meta['signature'] != snapshot_signature():
+            print("知识库快照版本已过期，将重新构建")
+            return None
+
+        files_dir = os.path.join(directory, 'files')
+        kb = {title: read_snapshot_record(os.path.join(files_dir, name + '.pkl'))
+              for title, name in meta['records'].items()}
+        line_index = read_snapshot_record(os.path.join(directory, meta['line_index']))
+
+        if meta['bm25'] is not None:
+            # 词表之后构建的文件没有保存词频，构建时再分词
+            bm25_dir = os.path.join(directory, 'bm25', meta['bm25']['vocabulary_id'])
+            files = {}
+            for title, name in meta['records'].items():
+                path = os.path.join(bm25_dir, name + '.pkl')
+                if os.path.exists(path):
+                    files[title] = read_snapshot_record(path)
+            with bm25_lock:
+                latest_bm25_index = {
+                    'vocabulary_id': meta['bm25']['vocabulary_id'],
+                    'vocabulary': meta['bm25']['vocabulary'],
+                    'files': files,
+                    'matrix': None,
+                    'titles': [],
+                    'texts': []
+                }
+        print(f"已加载知识库快照: {directory}，共 {len(kb)} 个文件")
+        return {
+            'knowledge_base': kb,
+            'line_index': line_index,
+            'bm25_index': None,
+            'manifest': meta['manifest'],
+            'version': meta['version']
+        }
+    except Exception as e:
+        print(f"加载知识库快照失败 {directory}: {str(e)}")
+        return None
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+# 后台重建
+def update_rebuild_status(**fields):
+    """更新后台重建状态"""
+    with rebuild_status_lock:
+        rebuild_status.update(fields)
+
+def get_rebuild_status():
+    """返回后台重建状态的副本"""
+    with rebuild_status_lock:
+        status = dict(rebuild_status)
+    status['files'] = len(knowledge_snapshot['knowledge_base'])
+    status['version'] = knowledge_snapshot['version']
+    return status
+
+def start_background_rebuild(full_rebuild=False):
+    """在后台线程中重建知识库快照，已有重建任务在进行时返回False"""
+    with rebuild_status_lock:
+        if rebuild_status['state'] == 'running':
+            return False
+        rebuild_status.update(state='running', processed=0, total=0, message='等待开始',
+                              started_at=time.time(), finished_at=None)
+
+    def run():
+        try:
+            initialize_knowledge(full_rebuild)
+        except Exception as e:
+            print(f"后台重建知识库时发生错误: {str(e)}")
+
+    threading.Thread(target=run, name='knowledge-rebuild', daemon=True).start()
+    return True
+
+# 标题识别模式，支持多级标题（增加对Markdown风格标题的支持）
+TITLE_PATTERNS = [
+    (re.compile(r'^#\s+(.+)'), 1),          # Markdown一级标题（如# 标题）
+    (re.compile(r'^##\s+(.+)'), 2),         # Markdown二级标题（如## 标题）
+    (re.compile(r'^###\s+(.+)'), 3),        # Markdown三级标题（如### 标题）
+    (re.compile(r'^####\s+(.+)'), 4),       # Markdown四级标题（如#### 标题）
+    (re.compile(r'^#####\s+(.+)'), 5),      # Markdown五级标题（如##### 标题）
+    (re.compile(r'^######\s+(.+)'), 6),     # Markdown六级标题（如###### 标题）
+    (re.compile(r'^===\s*(.+?)\s*==='), 0),  # 一级标题（如=== 正文内容 ===）
+    (re.compile(r'^(\d+)\s+(.+)'), 1),      # 一级标题（如1 标题）
+    (re.compile(r'^第[一二三四五六七八九十百]+章\s+(.+)'), 1),  # 一级标题（如第一章 标题）
+    (re.compile(r'^[一二三四五六七八九十百]+\s+(.+)'), 1),    # 一级标题（如一 标题）
+    (re.compile(r'^(\d+)\.(.+)'), 2),      # 二级标题（如1.1 标题）
+    (re.compile(r'^[（(]\d+[）)]\s*[\u4e00-\u9fa5]+'), 2),  # 二级标题（如（一）标题）
+    (re.compile(r'^(\d+)\.(\d+)\.(.+)'), 3),  # 三级标题（如1.1.1 标题）
+    (re.compile(r'^(\d+)\.(\d+)\.(\d+)\.(.+)'), 4)  # 四级标题（如1.1.1.1 标题）
+]
+
+# 文档结构预解析
+def heading_level(line):
+    """返回行的标题层级，不是标题时返回None"""
+    for pattern, level in TITLE_PATTERNS:
+        if pattern.match(line):
+            return level
+    return None
+
+def parse_document(content):
+    """预解析文档结构：行表、各行标题层级、标题树和章节范围，供查询时直接读取"""
+    lines = [line.strip() for line in content.strip().split('\n')]
+    levels = [heading_level(line) if line else None for line in lines]
+
+    headings = []
+    heading_of_line = {}
+    stack = []  # 当前标题路径上的标题序号
+    for i, level in enumerate(levels):
+        if level is None:
+            continue
+        # 标题树：父标题是之前最近的一个层级更高（数值更小）的标题
+        while stack and headings[stack[-1]]['level'] >= level:
+            # 章节到下一个同级或更高级标题之前结束
+            headings[stack.pop()]['end'] = i
+        parent = stack[-1] if stack else None
+        heading_of_line[i] = len(headings)
+        headings.append({
+            'line': i,
+            'level': level,
+            'text': lines[i],
+            'parent': parent,
+            'children': [],
+            'end': len(lines),
+            'body_end': len(lines)
+        })
+        if parent is not None:
+            headings[parent]['children'].append(len(headings) - 1)
+        stack.append(len(headings) - 1)
+
+    # 标题正文：标题之后到第一个空行或下一个标题之前
+    for heading in headings:
+        j = heading['line'] + 1
+        while j < len(lines) and lines[j] and levels[j] is None:
+            j += 1
+        heading['body_end'] = j
+
+    # 段落：以空行分隔的连续非空行 (起始行, 结束行)
+    paragraphs = []
+    start = None
+    for i, line in enumerate(lines):
+        if line and start is None:
+            start = i
+        elif not line and start is not None:
+            paragraphs.append((start, i))
+            start = None
+    if start is not None:
+        paragraphs.append((start, len(lines)))
+
+    return {
+        'lines': lines,
+        'lines_lower': [line.lower() for line in lines],
+        'levels': levels,
+        'titles': [(h['line'], h['level'], h['text']) for h in headings],
+        'title_lines': [h['line'] for h in headings],
+        'headings': headings,
+        'heading_of_line': heading_of_line,
+        'paragraphs': paragraphs
+    }
+
+# 行级倒排索引
+def line_terms(line_lower):
+    """提取一行文本中所有相邻两个字符组成的词项"""
+    return {line_lower[i:i + 2] for i in range(len(line_lower) - 1)}
+
+def writable_postings(index, term, fresh_terms):
+    """取得可修改的倒排列表；fresh_terms不为None时先复制，避免修改旧快照共享的列表"""
+    postings = index.get(term)
+    if fresh_terms is not None and term not in fresh_terms:
+        postings = dict(postings) if postings else {}
+        index[term] = postings
+        fresh_terms.add(term)
+    elif postings is None:
+        postings = index[term] = {}
+    return postings
+
+def index_knowledge_lines(index, title, doc, fresh_terms=None):
+    """将单个知识库文件的所有行加入倒排索引"""
+    # 使用预解析的行表，保证行号与find_relevant_content一致
+    for line_no, line_lower in enumerate(doc['lines_lower']):
+        for term in line_terms(line_lower):
+            writable_postings(index, term, fresh_terms).setdefault(title, []).append(line_no)
+
+def remove_knowledge_lines(index, title, doc, fresh_terms=None):
+    """从倒排索引中移除单个知识库文件的所有行"""
+    for line_lower in doc['lines_lower']:
+        for term in line_terms(line_lower):
+            if title not in index.get(term, {}):
+                continue
+            postings = writable_postings(index, term, fresh_terms)
+            del postings[title]
+            if not postings:
+                del index[term]
+                # 之后再加入时需要重新创建
+                if fresh_terms is not None:
+                    fresh_terms.add(term)
+
+def lookup_term(term, snapshot):
+    """查找包含某个词的候选行，返回 {标题: 行号集合}；词过短无法使用索引时返回None"""
+    # 单字或跨行的词无法通过二元词项定位
+    if len(term) < 2 or '\n' in term or '\r' in term:
+        return None
+
+    postings_list = []
+    for t in line_terms(term):
+        postings = snapshot['line_index'].get(t)
+        if not postings:
+            return {}
+        postings_list.append(postings)
+
+    # 从最稀疏的词项开始求交集，结果是包含该词所有二元词项的行（候选行的超集）
+    postings_list.sort(key=len)
+    result = {title: set(line_nos) for title, line_nos in postings_list[0].items()}
+    for postings in postings_list[1:]:
+        for title in list(result):
+            if title in postings:
+                result[title].intersection_update(postings[title])
+            if title not in postings or not result[title]:
+                del result[title]
+        if not result:
+            break
+    return result
+
+def lookup_query_terms(query, snapshot):
+    """查找查询中每个可能得分的词对应的候选行，返回 {词: {标题: 行号集合}}；无法筛选时返回None"""
+    query_lower, query_words, has_special_keyword = parse_query(query)
+
+    # 行得分只来自于：包含关键词、包含完整查询、或包含特殊关键词
+    terms = set(query_words)
+    terms.add(query_lower)
+    if has_special_keyword:
+        terms.update(SPECIAL_KEYWORDS)
+
+    term_postings = {}
+    for term in terms:
+        postings = lookup_term(term, snapshot)
+        if postings is None:
+            return None
+        term_postings[term] = postings
+    return term_postings
+
+def find_candidate_lines(query, snapshot, term_postings=None):
+    """根据倒排索引找出查询可能命中的行，返回 {标题: 有序行号列表}；无法筛选时返回None"""
+    if term_postings is None:
+        term_postings = lookup_query_terms(query, snapshot)
+        if term_postings is None:
+            return None
+
+    candidates = {}
+    for postings in term_postings.values():
+        for title, line_nos in postings.items():
+            candidates.setdefault(title, set()).update(line_nos)
+    return {title: sorted(line_nos) for title, line_nos in candidates.items()}
+
+def score_upper_bound(query, title, term_postings, snapshot):
+    """根据倒排索引估计某个文件在本次查询中可能得到的最高段落得分"""
+    query_lower, query_words, has_special_keyword = parse_query(query)
+
+    # 文件中可能出现的查询词数量、是否可能包含完整查询和特殊关键词
+    matched = sum(1 for word in set(query_words) if title in term_postings.get(word, {}))
+    has_query = title in term_postings.get(query_lower, {})
+    has_special = has_special_keyword and any(title in term_postings.get(keyword, {}) for keyword in SPECIAL_KEYWORDS)
+    if not matched and not has_query and not has_special:
+        return 0
+
+    headings = snapshot['knowledge_base'][title]['doc']['headings']
+    min_level = min((h['level'] for h in headings), default=0)
+
+    # 逐行打分的上界：各项加分全部命中
+    coverage_bonus = 0
+    if query_words:
+        coverage_ratio = matched / len(query_words)
+        if coverage_ratio >= 0.8:
+            coverage_bonus = 10
+        elif coverage_ratio >= 0.6:
+            coverage_bonus = 5
+        elif coverage_ratio >= 0.5:
+            coverage_bonus = 2
+    line_bound = ((40 - min_level * 5 if matched else 0) + (30 + 15 if has_query else 0)
+                  + (10 if has_special else 0) + matched * 4 + coverage_bonus + (10 if matched else 0))
+    if query_words and matched == len(set(query_words)):
+        line_bound *= 1.5
+
+    # 标题回退匹配与句子匹配的上界
+    title_bound = (20 - min_level * 3 if matched else 0) + (30 if has_query else 0)
+    sentence_bound = matched * 5 + (15 if has_query else 0) + (10 if matched else 0)
+    return max(line_bound, title_bound, sentence_bound)
+
+
+def parse_query(query):
+    """解析查询，返回小写查询、过滤停用词后的关键词以及是否包含特殊关键词"""
     # 转换为小写用于匹配
     query_lower = query.lower()
-    
+
     # 分词并计算关键词，过滤停用词
-    stop_words = {'的', '了', '在', '是', '我', '有', '和', '就', '不', '人', '都', '一', '一个', '上', '也', '很', '到', '说', '要', '去', '你', '会', '着', '没有', '看', '好', '自己', '这'}
-    query_words = [word for word in query_lower.split() if len(word) > 1 and word not in stop_words]
-    
+    query_words = [word for word in query_lower.split() if len(word) > 1 and word not in STOP_WORDS]
+
     # 特殊关键词匹配，提高对毕业条件等重要信息的识别
-    special_keywords = {'毕业', '条件', '学位', '学分', '修业', '年限'}
-    has_special_keyword = len(set(query_words) & special_keywords) > 0
-    
+    has_special_keyword = len(set(query_words) & SPECIAL_KEYWORDS) > 0
+    return query_lower, query_words, has_special_keyword
+
+
+# BM25检索
+def tokenize_text(text):
+    """使用jieba分词，过滤空白、标点和停用词"""
+    return [token for token in jieba.lcut(text.lower())
+            if token.strip() and token not in STOP_WORDS and re.search(r'\w', token)]
+
+def build_bm25_units(title, doc):
+    """将文档切分为检索单元并分词：每个段落附带其所属的最近标题，返回 [(文本, 词列表), ...]"""
+    units = []
+    title_lines = doc['title_lines']
+    for start, end in doc['paragraphs']:
+        text = ' '.join(doc['lines'][start:end])
+        # 段落本身不是标题时，在前面加上所属标题，作为上下文一起检索和展示
+        k = bisect_right(title_lines, start) - 1
+        if k >= 0 and title_lines[k] < start:
+            text = doc['lines'][title_lines[k]] + ' ' + text
+        tokens = tokenize_text(text)
+        if tokens:
+            units.append((text, tokens))
+    return units
+
+def count_bm25_terms(units, vocabulary):
+    """统计检索单元的词频，返回CSR矩阵（单元 × 词表）；词表中没有的词追加到词表末尾"""
+    indptr = [0]
+    indices = []
+    counts = []
+    for text, tokens in units:
+        term_counts = {}
+        for token in tokens:
+            column = vocabulary.get(token)
+            if column is None:
+                column = vocabulary[token] = len(vocabulary)
+            term_counts[column] = term_counts.get(column, 0) + 1
+        indices.extend(term_counts.keys())
+        counts.extend(term_counts.values())
+        indptr.append(len(indices))
+    return sparse.csr_matrix(
+        (np.array(counts, dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int32)),
+        shape=(len(units), len(vocabulary)))
+
+def build_bm25_index(knowledge_base, manifest, previous=None, k1=1.5, b=0.75):
+    """用各文件的词频矩阵构建BM25权重的稀疏矩阵（单元 × 词表）
+
+    previous为之前构建的索引：沿用其词表（只追加不删除，已有的列号不变），内容哈希未变的文件
+    直接复用其词频矩阵，只对新增和修改的文件分词。
+    """
+    vocabulary = previous['vocabulary'] if previous else {}
+    # 词表ID标识同一个词表，持久化的词频矩阵只与同一词表一起使用
+    vocabulary_id = previous['vocabulary_id'] if previous else uuid.uuid4().hex
+    previous_files = previous['files'] if previous else {}
+    files = {}
+    for title, knowledge in knowledge_base.items():
+        content_hash = manifest[knowledge['file']]['hash']
+        cached = previous_files.get(title)
+        if cached is None or cached['hash'] != content_hash:
+            units = build_bm25_units(title, knowledge['doc'])
+            cached = {
+                'hash': content_hash,
+                'texts': [text for text, tokens in units],
+                'counts': count_bm25_terms(units, vocabulary)
+            }
+        files[title] = cached
+
+    # 按文件顺序拼接词频矩阵；较早构建的矩阵列数较少，补齐到当前词表大小（不复制数据）
+    width = len(vocabulary)
+    unit_titles = []
+    unit_texts = []
+    blocks = []
+    for title, cached in files.items():
+        if not cached['texts']:
+            continue
+        unit_titles.extend([title] * len(cached['texts']))
+        unit_texts.extend(cached['texts'])
+        counts = cached['counts']
+        blocks.append(sparse.csr_matrix((counts.data, counts.indices, counts.indptr),
+                                        shape=(counts.shape[0], width), copy=False))
+
+    matrix = None
+    if blocks:
+        counts = sparse.vstack(blocks, format='csr')
+
+        # BM25词频饱和与文档长度归一化，直接在CSR的非零元素上计算
+        n_units = counts.shape[0]
+        doc_len = np.asarray(counts.sum(axis=1)).ravel()
+        avg_len = doc_len.mean()
+        row_len = np.repeat(doc_len, np.diff(counts.indptr))
+        tf = counts.data
+        counts.data = tf * (k1 + 1) / (tf + k1 * (1 - b + b * row_len / avg_len))
+
+        # 逆文档频率
+        df = np.bincount(counts.indices, minlength=width)
+        idf = np.log(1 + (n_units - df + 0.5) / (df + 0.5)).astype(np.float32)
+        counts.data *= idf[counts.indices]
+        # 按列（词）存储，查询时只需访问查询词对应的列
+        matrix = counts.tocsc()
+
+    return {
+        'vocabulary_id': vocabulary_id,
+        'vocabulary': vocabulary,
+        'files': files,
+        'matrix': matrix,
+        'titles': unit_titles,
+        'texts': unit_texts
+    }
+
+def get_bm25_index(snapshot, previous=None):
+    """返回快照的BM25索引，尚未构建时构建后缓存在快照中
+
+    以最近一次构建的索引（没有时为previous，即上一个快照的索引）为基础增量构建，只对变化的文件分词。
+    """
+    global latest_bm25_index
+    bm25_index = snapshot['bm25_index']
+    if bm25_index is not None:
+        return bm25_index
+    with bm25_lock:
+        if snapshot['bm25_index'] is not None:
+            return snapshot['bm25_index']
+        bm25_index = build_bm25_index(snapshot['knowledge_base'], snapshot['manifest'],
+                                      latest_bm25_index or previous)
+        snapshot['bm25_index'] = latest_bm25_index = bm25_index
+    # 当前快照在发布之后才构建的索引，在后台保存新分词的文件
+    if snapshot is knowledge_snapshot:
+        schedule_snapshot_save(snapshot)
+    return bm25_index
+
+def build_query_matrix(queries, vocabulary, size=None):
+    """将一批查询转换为词频矩阵（词表 × 查询数），未登录词忽略
+
+    size为索引矩阵的列数，词表在索引构建之后追加的词不在索引中，同样忽略。
+    """
+    size = len(vocabulary) if size is None else size
+    rows, cols, counts = [], [], []
+    for j, query in enumerate(queries):
+        term_counts = {}
+        for token in tokenize_text(query):
+            column = vocabulary.get(token)
+            if column is not None and column < size:
+                term_counts[column] = term_counts.get(column, 0) + 1
+        rows.extend(term_counts.keys())
+        cols.extend([j] * len(term_counts))
+        counts.extend(term_counts.values())
+    return sparse.csc_matrix(
+        (np.array(counts, dtype=np.float32), (np.array(rows, dtype=np.int32), np.array(cols, dtype=np.int32))),
+        shape=(size, len(queries)))
+
+def bm25_search(query, top_k=5, snapshot=None):
+    """BM25检索：查询向量与权重矩阵做一次稀疏矩阵向量乘法，返回 [(得分, 标题, 文本), ...]"""
+    return bm25_search_many([query], top_k, snapshot)[0]
+
+def bm25_search_many(queries, top_k=5, snapshot=None):
+    """批量BM25检索：整批查询与权重矩阵做一次稀疏矩阵乘法，按查询顺序返回各自的结果列表"""
+    if snapshot is None:
+        snapshot = knowledge_snapshot
+    if not queries:
+        return []
+    bm25_index = get_bm25_index(snapshot)
+    if bm25_index['matrix'] is None:
+        return [[] for _ in queries]
+    query_matrix = build_query_matrix(queries, bm25_index['vocabulary'], bm25_index['matrix'].shape[1])
+
+    # 结果只包含命中查询词的单元，计算量与查询词的倒排长度相关，与总行数无关
+    result = (bm25_index['matrix'] @ query_matrix).tocsc()
+    all_results = []
+    for j in range(len(queries)):
+        start, end = result.indptr[j], result.indptr[j + 1]
+        units = result.indices[start:end]
+        scores = result.data[start:end]
+        if len(scores) == 0:
+            all_results.append([])
+            continue
+
+        # 只对前top_k个结果排序，得分相同时保持单元顺序
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((units[top], -scores[top]))]
+        all_results.append([(float(scores[i]), bm25_index['titles'][units[i]], bm25_index['texts'][units[i]])
+                            for i in top if scores[i] > 0])
+    return all_results
+
+def process_query_bm25(query, snapshot, results=None):
+    """bm25模式下的查询处理，回答格式与关键词模式一致；results为批量检索预先算好的结果"""
+    if results is None:
+        results = bm25_search(query, top_k=1, snapshot=snapshot)
+    if not results:
+        return f"未找到与'{query}'相关的信息，请尝试其他关键词。"
+    score, title, text = results[0]
+    simplified_content = simplify_text(text)
+    simple_file_name = snapshot['knowledge_base'][title]['file'].replace('.txt', '')
+    return f"{simplified_content} [来源: {simple_file_name}]"
+
+
+
+# 关键词匹配函数
+def find_relevant_content(query, knowledge_content, file_name, candidate_lines=None, doc=None):
+    """在知识库内容中查找与查询相关的部分，特别关注各级标题"""
+    scored_sections = score_relevant_content(query, knowledge_content, file_name, candidate_lines, doc)
+    return [section for score, section in scored_sections]
+
+def score_relevant_content(query, knowledge_content, file_name, candidate_lines=None, doc=None):
+    """在知识库内容中查找与查询相关的部分，返回按得分排序的 [(得分, 段落), ...]
+
+    candidate_lines为倒排索引给出的候选行号，提供时只对候选行及其所在段落的上下文打分，
+    其余行不可能得分，结果与逐行扫描一致。doc为parse_document的预解析结果，未提供时现场解析。
+    """
+    query_lower, query_words, has_special_keyword = parse_query(query)
+    special_keywords = SPECIAL_KEYWORDS
+
     relevant_sections = []
     
     # 特殊处理answers.txt格式的问答对
@@ -124,35 +925,11 @@ def find_relevant_content(query, knowledge_content, file_name):
                     if section_score >= 12:
                         relevant_sections.append((section_score, full_content))
     else:
-        # 常规文本处理 - 按行分割以更好地捕获结构化信息
-        lines = knowledge_content.strip().split('\n')
-        
-        # 标题识别模式，支持多级标题（增加对Markdown风格标题的支持）
-        title_patterns = [
-            (r'^#\s+(.+)', 1),          # Markdown一级标题（如# 标题）
-            (r'^##\s+(.+)', 2),         # Markdown二级标题（如## 标题）
-            (r'^###\s+(.+)', 3),        # Markdown三级标题（如### 标题）
-            (r'^####\s+(.+)', 4),       # Markdown四级标题（如#### 标题）
-            (r'^#####\s+(.+)', 5),      # Markdown五级标题（如##### 标题）
-            (r'^######\s+(.+)', 6),     # Markdown六级标题（如###### 标题）
-            (r'^===\s*(.+?)\s*===', 0),  # 一级标题（如=== 正文内容 ===）
-            (r'^(\d+)\s+(.+)', 1),      # 一级标题（如1 标题）
-            (r'^第[一二三四五六七八九十百]+章\s+(.+)', 1),  # 一级标题（如第一章 标题）
-            (r'^[一二三四五六七八九十百]+\s+(.+)', 1),    # 一级标题（如一 标题）
-            (r'^(\d+)\.(.+)', 2),      # 二级标题（如1.1 标题）
-            (r'^[（(]\d+[）)]\s*[\u4e00-\u9fa5]+', 2),  # 二级标题（如（一）标题）
-            (r'^(\d+)\.(\d+)\.(.+)', 3),  # 三级标题（如1.1.1 标题）
-            (r'^(\d+)\.(\d+)\.(\d+)\.(.+)', 4)  # 四级标题（如1.1.1.1 标题）
-        ]
-        
-        # 存储标题行号和层级
-        title_positions = []
-        for i, line in enumerate(lines):
-            line = line.strip()
-            for pattern, level in title_patterns:
-                if re.match(pattern, line):
-                    title_positions.append((i, level, line))
-                    break
+        # 常规文本处理 - 使用加载时预解析的文档结构
+        if doc is None:
+            doc = parse_document(knowledge_content)
+        lines = doc['lines']
+        title_positions = doc['titles']
         
         # 将连续的相关行合并为段落，并特别关注标题
         current_section = []
@@ -161,9 +938,34 @@ def find_relevant_content(query, knowledge_content, file_name):
         
         # 记录当前段落之前的所有标题，以便在匹配时包含相关标题
         recent_titles = []
-        
-        for i, line in enumerate(lines):
-            line = line.strip()
+
+        # 需要扫描的行：未提供候选行时逐行扫描
+        if candidate_lines is None:
+            candidate_lines = range(len(lines))
+        candidate_set = set(candidate_lines)
+        sorted_candidates = sorted(candidate_set)
+        title_line_numbers = doc['title_lines']
+
+        i = -1
+        while True:
+            # 段落构建中逐行推进，否则直接跳到下一个候选行
+            if current_section or i + 1 in candidate_set:
+                i += 1
+            else:
+                k = bisect_right(sorted_candidates, i)
+                if k == len(sorted_candidates):
+                    break
+                next_i = sorted_candidates[k]
+                # 被跳过的区间内没有正在构建的段落，其中的标题只需按顺序记入recent_titles
+                start = bisect_left(title_line_numbers, i + 1)
+                end = bisect_left(title_line_numbers, next_i)
+                recent_titles.extend(title_positions[t][2] for t in range(max(start, end - 3), end))
+                del recent_titles[:-3]
+                i = next_i
+            if i >= len(lines):
+                break
+
+            line = lines[i]
             if not line:
                 # 如果是空行，处理当前段落并重置
                 if current_section:
@@ -175,32 +977,28 @@ def find_relevant_content(query, knowledge_content, file_name):
                 continue
             
             # 检查是否是标题行
-            is_title = False
-            for _, _, title_line in title_positions:
-                if line == title_line:
-                    is_title = True
-                    # 将当前标题添加到recent_titles
-                    recent_titles.append(line)
-                    # 限制recent_titles数量，只保留最近的几个标题
-                    if len(recent_titles) > 3:
-                        recent_titles.pop(0)
-                    break
+            level = doc['levels'][i]
+            is_title = level is not None
+            if is_title:
+                # 将当前标题添加到recent_titles
+                recent_titles.append(line)
+                # 限制recent_titles数量，只保留最近的几个标题
+                if len(recent_titles) > 3:
+                    recent_titles.pop(0)
             
             # 计算当前行的得分
-            line_lower = line.lower()
+            line_lower = doc['lines_lower'][i]
             line_score = 0
             line_matched_words = set()
             
             # 1. 增强的标题匹配 - 支持所有级别标题
-            for pattern, level in title_patterns:
-                if re.match(pattern, line):
-                    # 标题匹配关键词
-                    if any(keyword in line_lower for keyword in query_words):
-                        line_score += 40 - level * 5  # 层级越低权重越高
-                    # 标题包含完整查询
-                    if query_lower in line_lower:
-                        line_score += 30
-                    break
+            if is_title:
+                # 标题匹配关键词
+                if any(keyword in line_lower for keyword in query_words):
+                    line_score += 40 - level * 5  # 层级越低权重越高
+                # 标题包含完整查询
+                if query_lower in line_lower:
+                    line_score += 30
             
             # 2. 检查整行匹配
             if query_lower in line_lower:
@@ -272,7 +1070,7 @@ def find_relevant_content(query, knowledge_content, file_name):
         if not relevant_sections:
             # 专门查找与查询相关的标题
             for i, level, title_line in title_positions:
-                title_lower = title_line.lower()
+                title_lower = doc['lines_lower'][i]
                 title_score = 0
                 
                 # 检查标题中是否包含查询关键词
@@ -286,19 +1084,9 @@ def find_relevant_content(query, knowledge_content, file_name):
                 # 如果标题相关，收集标题及其可能的内容
                 if title_score >= 15:
                     title_content = [title_line]
-                    # 收集标题后的几行内容
-                    for j in range(i + 1, min(i + 8, len(lines))):  # 增加收集行数
-                        next_line = lines[j].strip()
-                        # 检查是否是下一个标题
-                        is_next_title = False
-                        for pattern, _ in title_patterns:
-                            if re.match(pattern, next_line):
-                                is_next_title = True
-                                break
-                        if not is_next_title and next_line:
-                            title_content.append(next_line)
-                        else:
-                            break
+                    # 收集标题后的几行内容，遇到空行或下一个标题为止
+                    body_end = doc['headings'][doc['heading_of_line'][i]]['body_end']
+                    title_content.extend(lines[i + 1:min(i + 8, body_end)])  # 增加收集行数
                     relevant_sections.append((title_score, ' '.join(title_content)))
         
         # 如果仍然没有找到，尝试更宽松的匹配
@@ -336,7 +1124,172 @@ def find_relevant_content(query, knowledge_content, file_name):
     relevant_sections.sort(reverse=True, key=lambda x: x[0])
     
     # 返回前5个最相关的结果，增加找到毕业条件等重要信息的概率
-    return [section for score, section in relevant_sections[:5]]
+    return relevant_sections[:5]
+
+# 跨文件排序
+def merge_relevant_sections(query, relevant):
+    """将单个文件中找到的相关段落合并为一个回答片段"""
+    # 特殊关键词识别，提高对毕业条件等重要信息的处理
+    has_special_keyword = any(keyword in query.lower() for keyword in SPECIAL_KEYWORDS)
+
+    # 根据查询类型采用不同的内容合并策略
+    if has_special_keyword:
+        # 对于毕业条件等特殊查询，合并所有找到的相关段落
+        # 按相关性顺序合并，确保重要信息优先显示
+        return ' '.join(relevant[:3])  # 合并前3个最相关的内容
+
+    # 对于普通查询，优先保留包含课程列表的内容
+    course_sections = [section for section in relevant if '、' in section]
+    other_sections = [section for section in relevant if '、' not in section]
+
+    # 先合并课程列表部分，再添加其他相关内容
+    return ' '.join(course_sections + other_sections[:1])
+
+def plan_relevant_files(query, snapshot):
+    """找出需要打分的文件及其得分上界，按上界从高到低排列 [(上界, 顺序, 标题, 候选行), ...]"""
+    # 通过倒排索引找出候选行，不包含任何查询词的文件无需扫描
+    term_postings = lookup_query_terms(query, snapshot)
+    candidates = find_candidate_lines(query, snapshot, term_postings) if term_postings is not None else None
+
+    pending = []
+    for order, (title, knowledge) in enumerate(snapshot['knowledge_base'].items()):
+        # 问答对文件按问题整体打分，仍然完整扫描
+        if candidates is None or "answers.txt" in knowledge['file']:
+            pending.append((float('inf'), order, title, None))
+        elif title in candidates:
+            bound = score_upper_bound(query, title, term_postings, snapshot)
+            pending.append((bound, order, title, candidates[title]))
+    pending.sort(key=lambda item: (-item[0], item[1]))
+    return pending
+
+def score_relevant_files(query, pending, top_k, snapshot=None):
+    """依次为文件打分，保留得分最高的top_k个结果 [(得分, -顺序, 标题, 段落, 文件名), ...]
+
+    pending需按得分上界从高到低排列，剩余文件的上界都低于当前第k名的得分时提前结束。
+    snapshot为None时使用当前进程的快照（并行打分的工作进程中即为初始化时载入的快照）。
+    """
+    if snapshot is None:
+        snapshot = knowledge_snapshot
+    # 小顶堆保存当前得分最高的top_k个结果
+    heap = []
+    for bound, order, title, candidate_lines in pending:
+        if len(heap) >= top_k and bound < heap[0][0]:
+            break
+        knowledge = snapshot['knowledge_base'][title]
+        # 传递文件名给匹配函数
+        scored_sections = score_relevant_content(query, knowledge['content'], knowledge['file'],
+                                                 candidate_lines, knowledge['doc'])
+        if not scored_sections:
+            continue
+        relevant = [section for score, section in scored_sections]
+        entry = (scored_sections[0][0], -order, title, merge_relevant_sections(query, relevant), knowledge['file'])
+        if len(heap) < top_k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+    return heap
+
+def rank_relevant_sections(query, top_k=TOP_K_SECTIONS, snapshot=None):
+    """在所有知识库中查找相关内容，返回得分最高的top_k个 [(得分, 标题, 合并后的段落, 文件名), ...]
+
+    按倒排索引估计的得分上界从高到低依次打分，当剩余文件的上界都不超过当前第k名的得分时提前结束。
+    得分相同时知识库中靠前的文件优先。
+    """
+    if snapshot is None:
+        snapshot = knowledge_snapshot
+    pending = plan_relevant_files(query, snapshot)
+
+    workers = scoring_workers()
+    entries = None
+    if workers > 1 and len(pending) >= PARALLEL_MIN_FILES:
+        # 进程池只服务当前快照，持有旧快照的查询串行打分
+        pool = get_scoring_pool(snapshot, workers)
+        if pool is not None:
+            # 按上界顺序轮流分配到各个分片，使每个分片都先处理上界高的文件
+            shards = [pending[i::workers] for i in range(workers)]
+            try:
+                futures = [pool.submit(score_relevant_files, query, shard, top_k) for shard in shards if shard]
+                entries = [entry for future in futures for entry in future.result()]
+            except RuntimeError as e:
+                # 进程池在提交前被新快照的进程池替换并关闭，改为串行
+                print(f"并行打分失败，改为串行: {str(e)}")
+    if entries is None:
+        entries = score_relevant_files(query, pending, top_k, snapshot)
+
+    # 合并结果，排序规则与串行一致，保证结果确定
+    entries = sorted(entries, reverse=True)[:top_k]
+    return [(score, title, section, file_name) for score, _, title, section, file_name in entries]
+
+# 并行打分进程池
+def init_scoring_worker(shared_snapshot):
+    """进程池工作进程的初始化：载入主进程解析好的知识库快照（pickle序列化后的字节串）"""
+    global knowledge_snapshot, knowledge_base, knowledge_initialized
+    knowledge_snapshot = pickle.loads(shared_snapshot)
+    knowledge_base = knowledge_snapshot['knowledge_base']
+    knowledge_initialized = len(knowledge_base) > 0
+
+def scoring_workers():
+    """实际使用的打分进程数：PARALLEL_WORKERS，不超过CPU核数"""
+    return min(PARALLEL_WORKERS, os.cpu_count() or 1)
+
+def get_scoring_pool(snapshot, workers):
+    """获取与当前快照对应的并行打分进程池；进程池未就绪或快照不是当前快照时返回None，由调用方串行打分
+
+    只有当前快照会创建或替换进程池，重建期间持有不同版本快照的查询不会反复重建进程池。
+    工作进程需要导入本模块并载入知识库，耗时数秒，因此进程池在后台线程中创建，就绪之前查询串行打分。
+    """
+    global scoring_pool
+    with scoring_pool_lock:
+        if snapshot['version'] != knowledge_snapshot['version']:
+            return None
+        if scoring_pool is not None and scoring_pool[0] == snapshot['version']:
+            return scoring_pool[1]
+        if scoring_pool is not None and scoring_pool[1] is not None:
+            # 旧进程池处理完已提交的任务后退出
+            scoring_pool[1].shutdown(wait=False)
+        # 进程池为None表示正在创建
+        scoring_pool = (snapshot['version'], None)
+    threading.Thread(target=start_scoring_pool, args=(snapshot, workers), name='scoring-pool', daemon=True).start()
+    return None
+
+def start_scoring_pool(snapshot, workers):
+    """创建并预热进程池，完成后登记为当前快照的进程池；期间快照已替换或进程池已关闭时丢弃"""
+    global scoring_pool
+    try:
+        # 工作进程只需要知识库内容，不需要索引；只序列化一次，各工作进程共用
+        shared_snapshot = pickle.dumps({'knowledge_base': snapshot['knowledge_base'], 'version': snapshot['version']},
+                                       protocol=pickle.HIGHEST_PROTOCOL)
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=SCORING_MP_CONTEXT,
+                                   initializer=init_scoring_worker,
+                                   initargs=(shared_snapshot,))
+        # 同时提交workers个空任务，启动全部工作进程并等待初始化完成
+        for future in [pool.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+    except Exception as e:
+        # 进程池登记保持为None，该版本的查询继续串行打分
+        print(f"创建并行打分进程池失败: {str(e)}")
+        return
+
+    with scoring_pool_lock:
+        if scoring_pool == (snapshot['version'], None):
+            scoring_pool = (snapshot['version'], pool)
+            return
+    pool.shutdown(wait=False)
+
+def shutdown_scoring_pool():
+    """关闭并行打分进程池"""
+    global scoring_pool
+    with scoring_pool_lock:
+        if scoring_pool is not None:
+            if scoring_pool[1] is not None:
+                scoring_pool[1].shutdown(wait=False)
+            scoring_pool = None
+
+def configure_parallel_scoring(workers):
+    """切换打分方式：workers为进程数，0表示串行"""
+    global PARALLEL_WORKERS
+    shutdown_scoring_pool()
+    PARALLEL_WORKERS = workers
 
 # 简化段落内容
 
@@ -353,51 +1306,44 @@ def simplify_text(text):
     return text
 
 # 查询处理函数
-def process_query(query):
-    """处理用户查询并返回回答"""
-    global knowledge_initialized
-    
-    query = query.strip()
-    print(f"处理查询: '{query}'")
-    
+def precheck_query(query, snapshot):
+    """检索前的通用检查，需要直接回复时返回回答，否则返回None"""
     # 检查是否询问系统相关信息
     if any(word in query.lower() for word in ["系统", "功能", "介绍", "说明", "帮助"]):
         return "这是一个基于知识库的问答系统，目前包含多个知识库文件，您可以提问相关内容。"
     
     # 检查知识库是否初始化
-    if not knowledge_initialized:
+    if not snapshot['knowledge_base']:
         return "知识库尚未初始化，请先点击页面上的'初始化知识库'按钮。"
+    return None
+
+def process_query(query, mode=None, snapshot=None):
+    """处理用户查询并返回回答，mode为检索模式，默认使用RETRIEVAL_MODE"""
+    # 整个查询过程使用同一个快照，后台重建替换快照不影响正在进行的查询
+    if snapshot is None:
+        snapshot = knowledge_snapshot
+    
+    query = query.strip()
+    print(f"处理查询: '{query}'")
+    
+    answer = precheck_query(query, snapshot)
+    if answer is not None:
+        return answer
+    
+    # BM25稀疏矩阵检索模式
+    if (mode or RETRIEVAL_MODE) == 'bm25':
+        return process_query_bm25(query, snapshot)
     
     # 特殊关键词识别，提高对毕业条件等重要信息的处理
-    special_keywords = {'毕业', '条件', '学位', '学分', '修业', '年限'}
+    special_keywords = SPECIAL_KEYWORDS
     has_special_keyword = any(keyword in query.lower() for keyword in special_keywords)
     
-    # 在所有知识库中查找相关内容
-    all_relevant = []
-    
-    for title, knowledge in knowledge_base.items():
-        # 传递文件名给匹配函数
-        relevant = find_relevant_content(query, knowledge['content'], knowledge['file'])
-        if relevant:
-            # 根据查询类型采用不同的内容合并策略
-            if has_special_keyword:
-                # 对于毕业条件等特殊查询，合并所有找到的相关段落
-                # 按相关性顺序合并，确保重要信息优先显示
-                merged_content = ' '.join(relevant[:3])  # 合并前3个最相关的内容
-            else:
-                # 对于普通查询，优先保留包含课程列表的内容
-                course_sections = [section for section in relevant if '、' in section]
-                other_sections = [section for section in relevant if '、' not in section]
-                
-                # 先合并课程列表部分，再添加其他相关内容
-                merged_content = ' '.join(course_sections + other_sections[:1])
-            
-            all_relevant.append((title, merged_content, knowledge['file']))
+    # 在所有知识库中查找相关内容，按得分跨文件排序
+    all_relevant = rank_relevant_sections(query, snapshot=snapshot)
     
-    # 按相关性排序（这里简化处理，假设第一个是最相关的）
     if all_relevant:
         # 只使用最相关的信息来构建回答
-        title, best_section, file_name = all_relevant[0]
+        score, title, best_section, file_name = all_relevant[0]
         
         # 简化内容，移除元数据但保留所有实际内容
         simplified_content = simplify_text(best_section)
@@ -410,7 +1356,7 @@ def process_query(query):
         # 未找到相关内容，但对于特殊关键词查询，尝试更宽松的搜索
         if has_special_keyword:
             # 尝试在所有知识库中进行更宽松的搜索
-            for title, knowledge in knowledge_base.items():
+            for title, knowledge in snapshot['knowledge_base'].items():
                 content_lower = knowledge['content'].lower()
                 # 检查是否包含任何特殊关键词
                 if any(keyword in content_lower for keyword in special_keywords):
@@ -431,6 +1377,68 @@ def process_query(query):
         # 未找到相关内容
         return f"未找到与'{query}'相关的信息，请尝试其他关键词。"
 
+def process_queries(queries, mode=None):
+    """批量处理查询，按输入顺序返回回答
+
+    整批使用同一个快照；bm25模式下所有查询一次分词、一次稀疏矩阵乘法完成打分，
+    关键词模式逐个处理，重复的查询只计算一次。
+    """
+    snapshot = knowledge_snapshot
+    queries = [query.strip() for query in queries]
+    print(f"批量处理查询: {len(queries)} 条")
+    
+    answers = {}
+    pending = []
+    seen = set()
+    for query in queries:
+        if query in seen:
+            continue
+        seen.add(query)
+        answer = precheck_query(query, snapshot)
+        if answer is not None:
+            answers[query] = answer
+        else:
+            pending.append(query)
+    
+    if (mode or RETRIEVAL_MODE) == 'bm25':
+        for query, results in zip(pending, bm25_search_many(pending, top_k=1, snapshot=snapshot)):
+            answers[query] = process_query_bm25(query, snapshot, results)
+    else:
+        for query in pending:
+            answers[query] = process_query(query, mode, snapshot)
+    return [answers[query] for query in queries]
+
+# 流式回答
+def retrieve_sources(query, mode, snapshot, top_k=TOP_K_SECTIONS):
+    """检索与查询最相关的段落，返回 [{'file', 'content', 'score'}, ...]，作为生成回答的参考信息"""
+    if (mode or RETRIEVAL_MODE) == 'bm25':
+        results = [(score, title, text, snapshot['knowledge_base'][title]['file'])
+                   for score, title, text in bm25_search(query, top_k=top_k, snapshot=snapshot)]
+    else:
+        results = rank_relevant_sections(query, top_k=top_k, snapshot=snapshot)
+    return [{'file': file_name.replace('.txt', ''), 'content': simplify_text(section), 'score': score}
+            for score, title, section, file_name in results]
+
+def build_answer_prompt(query, sources):
+    """根据检索到的参考信息构建生成回答的提示词"""
+    if not sources:
+        return f"""请用中文回答用户问题: {query}\n"""
+    # 在token预算内保留与问题最相关的句子，缩短模型的预填充时间
+    context = build_context(query, [source['content'] for source in sources])
+    return f"""你是一个专业的助手，任务是根据提供的参考信息回答用户问题。
+请严格基于参考信息进行回答，如果参考信息不足以回答问题，请回复'根据现有信息无法回答该问题'，不要编造信息。
+
+参考信息:\n{context}
+
+用户问题: {query}
+
+回答:
+"""
+
+def sse_event(event, data):
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 # 首页路由
 @app.route('/')
 def index():
@@ -440,7 +1448,23 @@ def index():
 @app.route('/api/init', methods=['POST'])
 def init_knowledge():
     try:
-        success = initialize_knowledge()
+        # 默认增量加载，请求中指定full为true时全部重建
+        data = request.get_json(silent=True) or {}
+        full_rebuild = bool(data.get('full'))
+        
+        # 默认在后台重建，构建期间查询继续使用旧快照；指定wait为true时等待重建完成
+        if not data.get('wait'):
+            started = start_background_rebuild(full_rebuild)
+            message = "知识库正在后台更新，可通过 /api/init/status 查看进度。" if started else "已有知识库更新任务正在进行。"
+            print(message)
+            return jsonify({
+                'status': 'success',
+                'message': message,
+                'rebuild': get_rebuild_status(),
+                'files': [k['file'] for k in knowledge_base.values()]
+            })
+        
+        success = initialize_knowledge(full_rebuild=full_rebuild)
         if success:
             message = f"知识库初始化成功！已加载 {len(knowledge_base)} 个知识库文件。"
             print(message)
@@ -458,20 +1482,29 @@ def init_knowledge():
         print(error_msg)
         return jsonify({'status': 'error', 'message': error_msg}), 500
 
+# 知识库重建状态API路由
+@app.route('/api/init/status', methods=['GET'])
+def init_status():
+    return jsonify(get_rebuild_status())
+
 # 问答API路由
 @app.route('/api/chat', methods=['POST'])
 def chat():
     try:
         data = request.get_json()
         query = data.get('query', '').strip()
+        mode = data.get('mode')
         
         if not query:
             return jsonify({'error': '问题不能为空，请输入您的问题。'})
         
+        if mode and mode not in RETRIEVAL_MODES:
+            return jsonify({'error': f"不支持的检索模式: {mode}，可选: {', '.join(RETRIEVAL_MODES)}"})
+        
         print(f"收到查询: '{query}'")
         
         # 处理查询并获取回答
-        answer = process_query(query)
+        answer = process_query(query, mode)
         
         print(f"生成回答: '{answer}'")
         
@@ -480,8 +1513,81 @@ def chat():
         print(f"处理错误: {str(e)}")
         return jsonify({'error': '处理您的请求时发生错误，请稍后重试。'}), 500
 
-# 初始化时尝试加载知识库
-initialize_knowledge()
+# 批量问答API路由
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    try:
+        data = request.get_json(silent=True) or {}
+        queries = data.get('queries')
+        mode = data.get('mode')
+        
+        if not isinstance(queries, list) or not queries:
+            return jsonify({'error': 'queries必须是非空的问题列表。'})
+        
+        if len(queries) > MAX_BATCH_QUERIES:
+            return jsonify({'error': f"单次最多提交 {MAX_BATCH_QUERIES} 个问题。"})
+        
+        if not all(isinstance(query, str) and query.strip() for query in queries):
+            return jsonify({'error': '问题不能为空，请输入您的问题。'})
+        
+        if mode and mode not in RETRIEVAL_MODES:
+            return jsonify({'error': f"不支持的检索模式: {mode}，可选: {', '.join(RETRIEVAL_MODES)}"})
+        
+        print(f"收到批量查询: {len(queries)} 条")
+        
+        # 处理查询并按请求顺序返回回答
+        answers = process_queries(queries, mode)
+        
+        return jsonify({'answers': answers})
+    except Exception as e:
+        print(f"处理错误: {str(e)}")
+        return jsonify({'error': '处理您的请求时发生错误，请稍后重试。'}), 500
+
+# 流式问答API路由（Server-Sent Events）
+@app.route('/api/chat/stream', methods=['GET', 'POST'])
+def chat_stream():
+    """先推送检索到的来源（sources事件），再逐段推送模型生成的文本（token事件），最后推送done事件"""
+    data = request.get_json(silent=True) or request.args
+    query = (data.get('query') or '').strip()
+    mode = data.get('mode')
+    
+    if not query:
+        return jsonify({'error': '问题不能为空，请输入您的问题。'})
+    
+    if mode and mode not in RETRIEVAL_MODES:
+        return jsonify({'error': f"不支持的检索模式: {mode}，可选: {', '.join(RETRIEVAL_MODES)}"})
+    
+    print(f"收到流式查询: '{query}'")
+    
+    def generate():
+        snapshot = knowledge_snapshot
+        try:
+            answer = precheck_query(query, snapshot)
+            if answer is not None:
+                yield sse_event('sources', [])
+                yield sse_event('token', answer)
+                yield sse_event('done', {'answer': answer})
+                return
+            
+            # 检索完成后立即推送来源，不等待模型生成
+            sources = retrieve_sources(query, mode, snapshot)
+            yield sse_event('sources', sources)
+            
+            parts = []
+            for text in generate_stream(build_answer_prompt(query, sources)):
+                parts.append(text)
+                yield sse_event('token', text)
+            yield sse_event('done', {'answer': ''.join(parts)})
+        except Exception as e:
+            print(f"流式回答错误: {str(e)}")
+            yield sse_event('error', {'error': '生成回答时发生错误，请稍后重试。'})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# 初始化时尝试加载知识库；forkserver/spawn启动的打分工作进程也会导入本模块，其知识库由进程池初始化时传入
+if multiprocessing.current_process().name == 'MainProcess':
+    initialize_knowledge()
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,83 @@
+import io
+import os
+import time
+import statistics
+from contextlib import redirect_stdout
+
+import app
+
+# 基准测试使用的查询，覆盖普通查询、特殊关键词查询和问答对查询
+BENCHMARK_QUERIES = [
+    "报到时间",
+    "新生报到需要准备哪些材料",
+    "毕业 条件",
+    "学位 学分",
+    "人工智能 课程",
+    "培养目标",
+    "数据 课程",
+    "修业 年限",
+    "学校有几个校区",
+    "专业 核心课程"
+]
+
+def time_queries(queries, repeat=3, mode=None):
+    """多次执行查询，返回每次查询的耗时（毫秒）和最后一轮的回答"""
+    timings = []
+    answers = []
+    for _ in range(repeat):
+        answers = []
+        for query in queries:
+            start = time.perf_counter()
+            # 屏蔽查询过程中的日志输出
+            with redirect_stdout(io.StringIO()):
+                answers.append(app.process_query(query, mode))
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings, answers
+
+def print_timings(name, timings):
+    """打印耗时统计"""
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name:<20} 平均 {statistics.mean(timings):8.2f} ms  中位数 {statistics.median(timings):8.2f} ms  P95 {p95:8.2f} ms")
+
+def benchmark_parallel_scoring(queries=BENCHMARK_QUERIES, worker_counts=(0, 4, 8), repeat=3):
+    """比较串行打分与不同进程数的并行打分，并确认各方式的回答一致"""
+    print("\n=== 串行/并行打分对比 ===")
+    baseline = None
+    for workers in worker_counts:
+        app.configure_parallel_scoring(workers)
+        # 预热：进程池在后台创建并加载知识库，就绪之前查询串行打分
+        for _ in range(600):
+            if app.scoring_workers() < 2 or app.get_scoring_pool(app.knowledge_snapshot, app.scoring_workers()):
+                break
+            time.sleep(0.1)
+        time_queries(queries[:1], repeat=1, mode='keyword')
+        timings, answers = time_queries(queries, repeat, mode='keyword')
+        # 进程数不超过CPU核数，实际不足2个进程时为串行
+        actual = app.scoring_workers()
+        name = "串行" if actual < 2 else f"并行 {actual} 进程"
+        print_timings(name, timings)
+        if baseline is None:
+            baseline = answers
+        elif answers != baseline:
+            print(f"  警告: {name} 的回答与串行结果不一致")
+    app.configure_parallel_scoring(0)
+
+def benchmark_retrieval_modes(queries=BENCHMARK_QUERIES, repeat=3):
+    """比较关键词模式与BM25模式的查询耗时"""
+    print("\n=== 检索模式对比 ===")
+    for mode in app.RETRIEVAL_MODES:
+        timings, _ = time_queries(queries, repeat, mode=mode)
+        print_timings(mode, timings)
+
+def main():
+    """主函数"""
+    if not app.knowledge_initialized:
+        print("知识库未初始化，无法进行基准测试")
+        return
+    print(f"知识库文件数: {len(app.knowledge_base)}，CPU核数: {os.cpu_count()}")
+    benchmark_retrieval_modes()
+    benchmark_parallel_scoring()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import sys
+import time
+import shutil
+import tempfile
+import statistics
+import numpy as np
+import chromadb
+
+import vector_store
+from vector_store import NumpyCollection, normalize_rows
+
+# 查询数量和每次查询返回的结果数
+QUERY_COUNT = 200
+TOP_K = 5
+
+# 比较的压缩方案：(存储精度, PCA维度，0表示不降维)
+COMPRESSION_OPTIONS = [('float32', 0), ('float16', 0), ('int8', 0),
+                       ('float32', 256), ('float16', 256), ('int8', 256), ('int8', 128)]
+
+def load_chunks_from_chroma(collection_name, path=vector_store.DB_PATH):
+    """从已有的Chroma集合读取全部片段（ID、向量、文档、元数据）"""
+    collection = chromadb.PersistentClient(path=path).get_collection(collection_name)
+    result = collection.get(include=['embeddings', 'documents', 'metadatas'])
+    return result['ids'], np.asarray(result['embeddings'], dtype=np.float32), result['documents'], result['metadatas']
+
+def synthetic_chunks(count, dim=768, clusters=64, seed=0):
+    """生成带聚类结构的随机向量，没有可用的向量库时用于测试"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(0, clusters, count)] + rng.normal(scale=0.6, size=(count, dim))
+    ids = [f"chunk-{i}" for i in range(count)]
+    return ids, vectors.astype(np.float32), [f"文档 {i}" for i in range(count)], [{'chunk_index': i} for i in range(count)]
+
+def make_queries(vectors, count=QUERY_COUNT, seed=1):
+    """取已有向量加噪声作为查询向量"""
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.choice(len(vectors), count)]
+    return normalize_rows(picked + rng.normal(scale=0.02 * np.abs(picked).mean(), size=picked.shape))
+
+def time_search(search, queries):
+    """逐个执行查询，返回每次查询的耗时（毫秒）和结果ID列表"""
+    timings = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, results
+
+def recall_at_k(results, truth):
+    """结果相对于精确搜索的召回率"""
+    return statistics.mean(len(set(r) & set(t)) / len(t) for r, t in zip(results, truth) if t)
+
+def print_result(name, timings, recall=None):
+    """打印耗时和召回率"""
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    line = f"{name:<20} 平均 {statistics.mean(timings):8.3f} ms  中位数 {statistics.median(timings):8.3f} ms  P95 {p95:8.3f} ms"
+    if recall is not None:
+        line += f"  召回率@{TOP_K} {recall:.4f}"
+    print(line)
+
+def benchmark_vector_stores(ids, vectors, documents, metadatas):
+    """在同一批片段上比较Chroma与NumPy后端（精确搜索、IVF）的查询耗时和召回率"""
+    workdir = tempfile.mkdtemp(prefix='vector_bench_')
+    try:
+        # /api/embed 返回归一化的向量，两个后端都使用归一化后的向量，Chroma的L2距离与余弦距离排序一致
+        vectors = normalize_rows(vectors)
+        print(f"片段数: {len(ids)}，向量维度: {vectors.shape[1]}")
+        batch = 1000
+
+        # 两个后端写入相同的数据
+        start = time.perf_counter()
+        chroma = chromadb.PersistentClient(path=f"{workdir}/chroma").get_or_create_collection('bench')
+        for i in range(0, len(ids), batch):
+            chroma.add(ids=ids[i:i + batch], embeddings=vectors[i:i + batch],
+                       documents=documents[i:i + batch], metadatas=metadatas[i:i + batch])
+        print(f"Chroma写入耗时: {time.perf_counter() - start:.2f} s")
+
+        start = time.perf_counter()
+        store = NumpyCollection('bench', f"{workdir}/numpy")
+        for i in range(0, len(ids), batch):
+            store.upsert(ids[i:i + batch], vectors[i:i + batch], documents[i:i + batch], metadatas[i:i + batch])
+        store.persist()
+        print(f"NumPy写入耗时: {time.perf_counter() - start:.2f} s")
+
+        # 重新打开，向量矩阵以内存映射方式加载
+        start = time.perf_counter()
+        store = NumpyCollection('bench', f"{workdir}/numpy")
+        print(f"NumPy加载耗时: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        queries = make_queries(vectors)
+        exact_timings, truth = time_search(
+            lambda q: store.query([q], n_results=TOP_K, exact=True)['ids'][0], queries)
+        chroma_timings, chroma_results = time_search(
+            lambda q: chroma.query(query_embeddings=[q], n_results=TOP_K)['ids'][0], queries)
+
+        print("\n=== 单条查询 ===")
+        print_result("chroma", chroma_timings, recall_at_k(chroma_results, truth))
+        print_result("numpy 精确", exact_timings, 1.0)
+
+        # IVF：聚类数较多时只搜索部分聚类
+        store.build_ivf()
+        for nprobe in (4, 8, 16):
+            ivf_timings, ivf_results = time_search(
+                lambda q: [store.ids[row] for row, score in store.search(store.snapshot(), q[None, :], TOP_K, nprobe=nprobe)[0]],
+                queries)
+            print_result(f"numpy IVF nprobe={nprobe}", ivf_timings, recall_at_k(ivf_results, truth))
+
+        print("\n=== 批量查询 ===")
+        start = time.perf_counter()
+        chroma.query(query_embeddings=queries, n_results=TOP_K)
+        print(f"chroma               {len(queries)} 条查询共 {(time.perf_counter() - start) * 1000:8.2f} ms")
+        start = time.perf_counter()
+        store.query(queries, n_results=TOP_K, exact=True)
+        print(f"numpy 精确           {len(queries)} 条查询共 {(time.perf_counter() - start) * 1000:8.2f} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def benchmark_compression(ids, vectors, documents, metadatas):
+    """比较NumPy后端各压缩方案（float16、int8、PCA降维）的向量占用、查询耗时和召回率（以float32精确搜索为准）"""
+    workdir = tempfile.mkdtemp(prefix='vector_compress_')
+    try:
+        vectors = normalize_rows(vectors)
+        queries = make_queries(vectors)
+        batch = 1000
+        print(f"\n=== 压缩存储（{len(ids)} 个片段，{vectors.shape[1]} 维，精确搜索） ===")
+        truth = None
+        baseline = None
+        for dtype, pca_dim in COMPRESSION_OPTIONS:
+            if pca_dim >= vectors.shape[1]:
+                continue
+            name = f"{dtype}" + (f" PCA{pca_dim}" if pca_dim else "")
+            directory = f"{workdir}/{dtype}_{pca_dim}"
+            store = NumpyCollection('bench', directory, dtype=dtype, pca_dim=pca_dim)
+            for i in range(0, len(ids), batch):
+                store.upsert(ids[i:i + batch], vectors[i:i + batch], documents[i:i + batch], metadatas[i:i + batch])
+            store.persist()
+            store = NumpyCollection('bench', directory)
+            size = store.matrix.nbytes
+            timings, results = time_search(lambda q: store.query([q], n_results=TOP_K, exact=True)['ids'][0], queries)
+            start = time.perf_counter()
+            store.query(queries, n_results=TOP_K, exact=True)
+            batch_ms = (time.perf_counter() - start) * 1000
+            if truth is None:
+                truth, baseline = results, size
+            print_result(name, timings, recall_at_k(results, truth))
+            print(f"{'':<20} 向量占用 {size / 1e6:8.2f} MB（{baseline / size:.1f} 倍压缩）  "
+                  f"{len(queries)} 条批量查询共 {batch_ms:8.2f} ms")
+            # 压缩存储的IVF搜索只需转换候选聚类中的向量
+            if store.centroids is None:
+                store.build_ivf()
+            ivf_timings, ivf_results = time_search(lambda q: store.query([q], n_results=TOP_K)['ids'][0], queries)
+            print_result(f"{name} IVF", ivf_timings, recall_at_k(ivf_results, truth))
+            shutil.rmtree(directory, ignore_errors=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    """主函数：python benchmark_vectors.py [集合名]，或 python benchmark_vectors.py synthetic [片段数]"""
+    if len(sys.argv) > 1 and sys.argv[1] != 'synthetic':
+        chunks = load_chunks_from_chroma(sys.argv[1])
+    else:
+        chunks = synthetic_chunks(int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
+    benchmark_vector_stores(*chunks)
+    benchmark_compression(*chunks)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import os
+import re
+import itertools
+from collections import deque
+
+# 片段的目标长度（字符数），相邻段落合并到接近该长度，超长段落按句子切开
+CHUNK_SIZE = int(os.environ.get('CHUNK_SIZE', '500'))
+# 因长度切开的相邻片段之间重复的字符数，0表示不重叠
+CHUNK_OVERLAP = int(os.environ.get('CHUNK_OVERLAP', '0'))
+# 遇到标题时，当前片段不少于该长度才结束，否则与下一节合并，避免产生只有标题的碎片
+CHUNK_MIN_SIZE = int(os.environ.get('CHUNK_MIN_SIZE', '100'))
+# 读取文件时每次读入的字符数；没有空行的超长段落累积到该长度时在换行处切开，内存占用与文件大小无关
+READ_BLOCK_SIZE = 64 * 1024
+
+# web_scraper.py保存的文件头：标题、来源、提取时间，之后是正文分隔行
+HEADER_PATTERN = re.compile(r'^(标题|来源|提取时间)[:：]\s*(.*)$')
+BODY_MARKER = '=== 正文内容 ==='
+
+# 标题行的格式和层级：Markdown标题按#的个数（1-6级），编号标题排在其下："一、"为7级，"（一）"为8级，"1."为9级
+MARKDOWN_HEADING = re.compile(r'^(#{1,6})\s*(.+)$')
+NUMBERED_HEADINGS = [
+    (re.compile(r'^[一二三四五六七八九十百千]+[、\.．]'), 7),
+    (re.compile(r'^[（(][一二三四五六七八九十百千]+[)）]'), 8),
+    (re.compile(r'^\d+[\.、．](?!\d)'), 9),
+]
+# 编号标题通常较短，超过该长度的编号行视为正文
+MAX_HEADING_CHARS = 50
+
+SENTENCE_END = re.compile(r'(?<=[。！？!?；;\n])')
+PARAGRAPH_BREAK = re.compile(r'\n[ \t\r\f\v]*\n')
+
+def heading_level(line):
+    """判断一行是否为标题，返回 (层级, 标题文本)，不是标题时返回None"""
+    match = MARKDOWN_HEADING.match(line)
+    if match:
+        return len(match.group(1)), match.group(2).strip()
+    if len(line) <= MAX_HEADING_CHARS:
+        for pattern, level in NUMBERED_HEADINGS:
+            if pattern.match(line):
+                return level, line
+    return None
+
+def split_long_text(text, chunk_size):
+    """按句末标点把超长文本切成不超过chunk_size的几段，单句过长时按长度硬切"""
+    pieces = []
+    current = ''
+    for sentence in SENTENCE_END.split(text):
+        while len(sentence) > chunk_size:
+            if current:
+                pieces.append(current)
+                current = ''
+            pieces.append(sentence[:chunk_size])
+            sentence = sentence[chunk_size:]
+        if len(current) + len(sentence) > chunk_size and current:
+            pieces.append(current)
+            current = ''
+        current += sentence
+    if current.strip():
+        pieces.append(current)
+    return [piece.strip() for piece in pieces if piece.strip()]
+
+def iter_blocks(file_path, block_size=READ_BLOCK_SIZE):
+    """按块读取文件，逐块返回文本；utf-8-sig编码会去掉web_scraper.py写入的BOM"""
+    with open(file_path, encoding='utf-8-sig', mode='r') as fp:
+        while True:
+            block = fp.read(block_size)
+            if not block:
+                break
+            yield block
+
+def iter_paragraphs(blocks, max_chars=READ_BLOCK_SIZE):
+    """把文本块重新拼接为以空行分隔的段落，段落完整后立即返回"""
+    buffer = ''
+    for block in blocks:
+        buffer += block
+        parts = PARAGRAPH_BREAK.split(buffer)
+        # 最后一段可能还没有读完，留到下一块
+        buffer = parts.pop()
+        for part in parts:
+            if part.strip():
+                yield part.strip()
+        if len(buffer) > max_chars:
+            cut = buffer.rfind('\n', 0, max_chars) + 1 or max_chars
+            if buffer[:cut].strip():
+                yield buffer[:cut].strip()
+            buffer = buffer[cut:]
+    if buffer.strip():
+        yield buffer.strip()
+
+def iter_chunks(paragraphs, title=None, chunk_size=None, overlap=None, min_size=None):
+    """按标题和长度把段落合并为片段，片段完整后立即返回 {'text', 'headings'}
+
+    段落依次合并到接近chunk_size，遇到标题且当前片段已不少于min_size时开始新片段；
+    headings为片段开头所在的标题路径（文档标题在最前）。因长度切开的片段之间保留overlap个字符的重叠
+    （不超过chunk_size的一半），重叠部分计入片段长度，每个片段都不超过chunk_size。
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    overlap = min(CHUNK_OVERLAP if overlap is None else overlap, chunk_size // 2)
+    min_size = CHUNK_MIN_SIZE if min_size is None else min_size
+    root = [title] if title else []
+    path = []  # [(层级, 标题), ...]
+    current = []
+    current_len = 0
+    current_headings = None
+
+    for block in paragraphs:
+        heading = heading_level(block) if '\n' not in block else None
+        if heading:
+            if current_len >= min_size:
+                yield {'text': '\n\n'.join(current), 'headings': current_headings}
+                current, current_len, current_headings = [], 0, None
+            level, heading_text = heading
+            path = [(l, h) for l, h in path if l < level] + [(level, heading_text)]
+        if current_headings is None:
+            current_headings = root + [h for l, h in path]
+        pieces = deque(split_long_text(block, chunk_size) if len(block) > chunk_size else [block])
+        while pieces:
+            piece = pieces.popleft()
+            if current_len + len(piece) > chunk_size and current_len > 0:
+                text = '\n\n'.join(current)
+                yield {'text': text, 'headings': current_headings}
+                tail = text[-overlap:].strip() if overlap > 0 else ''
+                current = [tail] if tail else []
+                current_len = len(tail) + 2 if tail else 0
+                current_headings = root + [h for l, h in path]
+                if current_len + len(piece) > chunk_size:
+                    # 重叠部分占用了长度，段落放不下时按剩余长度再切开
+                    piece, *rest = split_long_text(piece, chunk_size - current_len)
+                    pieces.extendleft(reversed(rest))
+            current.append(piece)
+            current_len += len(piece) + 2
+    if current:
+        yield {'text': '\n\n'.join(current), 'headings': current_headings}
+
+def iter_document_chunks(paragraphs, chunk_size=None, overlap=None, min_size=None):
+    """切割一个知识库文件的段落：去掉web_scraper.py写入的文件头，文件头中的标题作为标题路径的根"""
+    paragraphs = iter(paragraphs)
+    first = next(paragraphs, None)
+    if first is None:
+        return
+    title = None
+    header = [HEADER_PATTERN.match(line.strip()) for line in first.lstrip('\ufeff').splitlines()]
+    if all(header):
+        # 文件头之后是正文分隔行
+        title = next((match.group(2).strip() for match in header if match.group(1) == '标题'), None)
+        first = next(paragraphs, None)
+        if first is not None and first.strip() == BODY_MARKER:
+            first = next(paragraphs, None)
+    if first is not None:
+        paragraphs = itertools.chain([first], paragraphs)
+    yield from iter_chunks(paragraphs, title, chunk_size, overlap, min_size)
+
+def iter_file_chunks(file_path, chunk_size=None, overlap=None, min_size=None):
+    """流式读取并切割一个知识库文件，逐个返回 {'text', 'headings'}，内存占用与文件大小无关"""
+    return iter_document_chunks(iter_paragraphs(iter_blocks(file_path)), chunk_size, overlap, min_size)
+
+def split_text(text, title=None, chunk_size=None, overlap=None, min_size=None):
+    """按标题和长度切割文本，返回 [{'text', 'headings'}, ...]"""
+    return list(iter_chunks(iter_paragraphs([text]), title, chunk_size, overlap, min_size))
+
+def split_document(data, chunk_size=None, overlap=None, min_size=None):
+    """切割一个知识库文件的内容，返回 [{'text', 'headings'}, ...]"""
+    return list(iter_document_chunks(iter_paragraphs([data]), chunk_size, overlap, min_size))
+
+def split_file(file_path, chunk_size=None, overlap=None, min_size=None):
+    """读取并切割一个知识库文件，返回 [{'text', 'headings'}, ...]"""
+    return list(iter_file_chunks(file_path, chunk_size, overlap, min_size))
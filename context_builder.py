@@ -0,0 +1,87 @@
+import os
+import re
+import math
+
+# 参考信息的token预算，超出时只保留与问题最相关的句子；设为0时保留完整的片段
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '800'))
+# 两个句子的字符二元组Jaccard相似度超过该值时视为重复，只保留一句
+NEAR_DUPLICATE_THRESHOLD = 0.8
+# 没有标点的超长句子（如表格行）按该长度切开
+MAX_SENTENCE_CHARS = 200
+
+CJK_PATTERN = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]')
+WORD_PATTERN = re.compile(r'[A-Za-z0-9]+')
+PUNCTUATION_PATTERN = re.compile(r'[^\s\w]')
+# 句子连同句末标点和换行一起切出，按原顺序拼接即可还原原文
+SENTENCE_PATTERN = re.compile(r'[^。！？!?；;\n]+[。！？!?；;]*\n*|\n+')
+NORMALIZE_PATTERN = re.compile(r'[\s\W_]+')
+
+def estimate_tokens(text):
+    """估算文本的token数：汉字约每字1个，英文单词和数字约每4个字符1个，标点每个1个"""
+    cjk = len(CJK_PATTERN.findall(text))
+    words = sum(math.ceil(len(word) / 4) for word in WORD_PATTERN.findall(text))
+    return cjk + words + len(PUNCTUATION_PATTERN.findall(text))
+
+def split_sentences(text):
+    """按句末标点和换行切分句子，超长的句子按固定长度切开"""
+    sentences = []
+    for sentence in SENTENCE_PATTERN.findall(text):
+        for start in range(0, len(sentence), MAX_SENTENCE_CHARS):
+            sentences.append(sentence[start:start + MAX_SENTENCE_CHARS])
+    return sentences
+
+def text_grams(text):
+    """去掉空白和标点后的字符二元组集合（只有一个字时为该字）"""
+    text = NORMALIZE_PATTERN.sub('', text.lower())
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+def compress_documents(query, documents, token_budget=None):
+    """抽取式压缩检索到的片段：在token预算内保留与问题最相关的句子，去掉重复的句子
+
+    每个片段先保留得分最高的一句，保证来源不变；剩余预算按得分从高到低填充。
+    返回与documents一一对应的压缩后文本，句子保持原文顺序，预算不足时片段可能为空字符串。
+    """
+    token_budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    if token_budget <= 0:
+        return list(documents)
+    query_grams = text_grams(query)
+    candidates = []
+    for d, document in enumerate(documents):
+        for s, sentence in enumerate(split_sentences(document)):
+            grams = text_grams(sentence)
+            if not grams:
+                continue
+            score = len(query_grams & grams) / math.sqrt(len(grams))
+            # 排名靠前的片段和片段开头（通常是标题）的句子略微优先
+            score += 0.1 / (1 + d) + (0.2 if s == 0 else 0)
+            candidates.append((score, d, s, sentence, grams))
+    candidates.sort(key=lambda item: (-item[0], item[1], item[2]))
+
+    # 每个片段得分最高的句子排在最前面
+    first = {}
+    for candidate in candidates:
+        first.setdefault(candidate[1], candidate)
+    ordered = list(first.values()) + [c for c in candidates if first[c[1]] is not c]
+
+    selected = {d: [] for d in range(len(documents))}
+    selected_grams = []
+    used = 0
+    for score, d, s, sentence, grams in ordered:
+        tokens = estimate_tokens(sentence)
+        if used + tokens > token_budget:
+            continue
+        if any(jaccard(grams, other) >= NEAR_DUPLICATE_THRESHOLD for other in selected_grams):
+            continue
+        selected[d].append((s, sentence))
+        selected_grams.append(grams)
+        used += tokens
+    return [''.join(sentence for s, sentence in sorted(selected[d])).strip() for d in range(len(documents))]
+
+def build_context(query, documents, token_budget=None):
+    """构建提示词中的参考信息：压缩后的片段按检索顺序用换行连接"""
+    return "\n".join(document for document in compress_documents(query, documents, token_budget) if document)
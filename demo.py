@@ -1,57 +1,26 @@
 import uuid
-import chromadb
-import requests
+import vector_store
+from ollama_client import embed_texts, generate
+from retriever import retrieve, reset_collections
+from context_builder import build_context
+from chunker import split_file
 
 
 def file_chunk_list():
-    # 1.读取文件内容
-    with open("knowledge/中医v1.txt", encoding='utf-8', mode='r') as fp:
-        data = fp.read()
-
-    # 2.根据换行切割
-    chunk_list = data.split("\n\n")
-    return [chunk for chunk in chunk_list if chunk]
-
-
-def ollama_embedding_by_api(text):
-    res = requests.post(
-        url="http://127.0.0.1:11434/api/embeddings",
-        json={
-            "model": "deepseek-r1:1.5b",
-            "prompt": text,
-            'temperature': 0.1,
-        }
-    )
-    embedding = res.json()['embedding']
-    return embedding
-
-
-def ollama_generate_by_api(prompt):
-    response = requests.post(
-        url="http://127.0.0.1:11434/api/generate",
-        json={
-            "model": "deepseek-r1:1.5b",
-            "prompt": prompt,
-            "stream": False,
-            'temperature': 0.1
-        }
-    )
-    res = response.json()['response']
-    return res
+    # 读取文件内容，按标题和长度切割
+    return [chunk['text'] for chunk in split_file("knowledge/中医v1.txt")]
 
 
 def initial():
-    client = chromadb.PersistentClient(path="db/chroma_demo")
-
-    # 创建集合
-    client.delete_collection("collection_v2")
-    collection = client.get_or_create_collection(name="collection_v2")
+    # 创建集合（后端由VECTOR_BACKEND决定，与检索时一致）
+    vector_store.delete_collection("collection_v2")
+    collection = vector_store.get_collection("collection_v2")
 
     # 构造数据
 
     documents = file_chunk_list()
     ids = [str(uuid.uuid4()) for _ in range(len(documents))]
-    embeddings = [ollama_embedding_by_api(text) for text in documents]
+    embeddings = embed_texts(documents, model="deepseek-r1:1.5b")
 
     # 插入数据
     collection.add(
@@ -59,19 +28,19 @@ def initial():
         documents=documents,
         embeddings=embeddings
     )
+    vector_store.flush(collection)
+    # 集合已重建，清除检索时缓存的旧集合句柄
+    reset_collections()
 
 
 def gen_by_ai(qs):
-    qs_embedding = ollama_embedding_by_api(qs)
-    client = chromadb.PersistentClient(path="db/chroma_demo")
-    collection = client.get_collection(name="collection_v2")
-    res = collection.query(query_embeddings=[qs_embedding, ], query_texts=qs, n_results=2)
-    result = res["documents"][0]
-    context = "\n".join(result)
+    hits = retrieve(qs, 2, collection_name="collection_v2", model="deepseek-r1:1.5b")
+    result = [hit['document'] for hit in hits]
+    context = build_context(qs, result)
     prompt = f"""你是一个中医问答机器人，任务是根据参考信息回答用户问题，如果参考信息不足以回答用户问题，请回复不知道，不要去杜撰任何信息，请用中文回答。
     参考信息：{context}，来回答问题：{qs}，
     """
-    result = ollama_generate_by_api(prompt)
+    result = generate(prompt)
     return result
 
 
@@ -0,0 +1,164 @@
+import os
+import time
+import sqlite3
+import struct
+import hashlib
+import threading
+import unicodedata
+import numpy as np
+
+# 向量缓存：以 (模型名, 规范化文本的哈希) 为键保存向量，入库和查询共用，重复文本不再调用模型
+CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db', 'embedding_cache.sqlite'))
+# 缓存条目上限，超过后按最近使用时间淘汰；设为0关闭缓存
+MAX_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', '200000'))
+# 每次淘汰时额外删除的比例，避免每次写入都触发淘汰
+EVICT_FRACTION = 0.05
+# 向量的存储精度：float32、float16或int8（每条向量按自身的取值范围量化），已有条目按写入时的精度读取
+CACHE_DTYPES = ('float32', 'float16', 'int8')
+CACHE_DTYPE = os.environ.get('EMBEDDING_CACHE_DTYPE', 'float32')
+
+# SQLite单次查询的参数个数上限
+QUERY_CHUNK_SIZE = 500
+
+connection = None
+connection_lock = threading.Lock()
+# 条目数的估计值：写入时按新增计数（覆盖已有条目时偏大），超过上限时才重新统计，避免每次写入都扫描全表
+entry_count = None
+
+def cache_enabled():
+    """是否启用向量缓存"""
+    return MAX_ENTRIES > 0
+
+def normalize_text(text):
+    """规范化文本：统一Unicode形式和换行符，去掉首尾空白"""
+    text = unicodedata.normalize('NFC', text)
+    return text.replace('\r\n', '\n').replace('\r', '\n').strip()
+
+def text_key(text):
+    """规范化文本的哈希值，作为缓存键的一部分"""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+def get_connection():
+    """获取共享的数据库连接，首次调用时建表"""
+    global connection
+    if connection is None:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        conn = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        # 旧版本的缓存表没有dtype列，已有条目均为float32
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(embeddings)")]
+        if 'dtype' not in columns:
+            conn.execute("ALTER TABLE embeddings ADD COLUMN dtype TEXT NOT NULL DEFAULT 'float32'")
+        conn.commit()
+        connection = conn
+    return connection
+
+def encode_vector(embedding, dtype):
+    """向量转换为缓存中保存的字节串，int8在量化值前保存最小值和步长"""
+    vector = np.asarray(embedding, dtype=np.float32)
+    if dtype == 'int8':
+        lo = float(vector.min())
+        scale = max(float(vector.max()) - lo, 1e-12) / 255
+        codes = (np.clip(np.rint((vector - lo) / scale), 0, 255) - 128).astype(np.int8)
+        return struct.pack('<ff', lo, scale) + codes.tobytes()
+    return vector.astype(np.float16 if dtype == 'float16' else np.float32).tobytes()
+
+def decode_vector(blob, dim, dtype):
+    """缓存中的字节串转换回向量列表"""
+    if dtype == 'int8':
+        lo, scale = struct.unpack_from('<ff', blob)
+        codes = np.frombuffer(blob, dtype=np.int8, count=dim, offset=8)
+        return (lo + scale * (codes.astype(np.float32) + 128)).tolist()
+    return np.frombuffer(blob, dtype=np.float16 if dtype == 'float16' else np.float32, count=dim).tolist()
+
+def get_embeddings(model, texts):
+    """批量查询缓存，按输入顺序返回向量列表，未命中的位置为None"""
+    keys = [text_key(text) for text in texts]
+    found = {}
+    with connection_lock:
+        conn = get_connection()
+        unique_keys = list(set(keys))
+        for start in range(0, len(unique_keys), QUERY_CHUNK_SIZE):
+            chunk = unique_keys[start:start + QUERY_CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f"SELECT text_hash, dim, vector, dtype FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [model] + chunk
+            ).fetchall()
+            for text_hash, dim, vector, dtype in rows:
+                found[text_hash] = decode_vector(vector, dim, dtype)
+
+        # 更新命中条目的最近使用时间
+        if found:
+            now = time.time()
+            conn.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                             [(now, model, text_hash) for text_hash in found])
+            conn.commit()
+    return [found.get(key) for key in keys]
+
+def put_embeddings(model, texts, embeddings, dtype=None):
+    """写入一批向量，超过容量上限时淘汰最久未使用的条目"""
+    dtype = dtype or CACHE_DTYPE
+    if dtype not in CACHE_DTYPES:
+        raise ValueError(f"不支持的向量缓存精度: {dtype}，可选: {', '.join(CACHE_DTYPES)}")
+    now = time.time()
+    rows = []
+    for text, embedding in zip(texts, embeddings):
+        rows.append((model, text_key(text), len(embedding), encode_vector(embedding, dtype), dtype, now))
+    with connection_lock:
+        conn = get_connection()
+        conn.executemany("INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vector, dtype, last_used) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+        evict_entries(conn, added=len(rows))
+
+def evict_entries(conn, max_entries=None, added=0):
+    """条目数超过上限时删除最久未使用的条目，多删除一部分留出余量；added为刚写入的条目数"""
+    global entry_count
+    if max_entries is None:
+        max_entries = MAX_ENTRIES
+    if entry_count is not None:
+        entry_count += added
+        if entry_count <= max_entries:
+            return 0
+    # 首次调用或估计值超过上限时统计实际条目数
+    (entry_count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+    if entry_count <= max_entries:
+        return 0
+    excess = entry_count - max_entries + int(max_entries * EVICT_FRACTION)
+    conn.execute("DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+    conn.commit()
+    entry_count -= excess
+    print(f"向量缓存已淘汰 {excess} 个最久未使用的条目")
+    return excess
+
+def cache_stats():
+    """返回缓存条目数、各模型的条目数和向量占用的字节数"""
+    with connection_lock:
+        conn = get_connection()
+        rows = conn.execute("SELECT model, COUNT(*) FROM embeddings GROUP BY model").fetchall()
+        (vector_bytes,) = conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+    return {'entries': sum(count for model, count in rows), 'models': dict(rows), 'vector_bytes': vector_bytes}
+
+def clear_cache(model=None):
+    """清空缓存，指定model时只清空该模型的条目"""
+    global entry_count
+    with connection_lock:
+        entry_count = None
+        conn = get_connection()
+        if model is None:
+            conn.execute("DELETE FROM embeddings")
+        else:
+            conn.execute("DELETE FROM embeddings WHERE model = ?", (model,))
+        conn.commit()
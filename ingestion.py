@@ -0,0 +1,414 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from queue import Queue, Full, Empty
+from ollama_client import embed_texts
+from embedding_cache import normalize_text
+from vector_store import flush, NumpyCollection, DB_PATH
+import semantic_cache
+
+# 入库文档的来源标记，同步时只处理带该标记的文档
+SOURCE = "knowledge_files"
+
+# 单次读取/删除向量库文档的数量，需小于Chroma的批量上限
+SYNC_BATCH_SIZE = 1000
+
+# 流水线每批向量化并写入的片段数，以及队列中最多缓存的批次数
+PIPELINE_BATCH_SIZE = 128
+PIPELINE_QUEUE_SIZE = 4
+
+# 切割文件的进程数（1为在读取线程中直接切割）和同时进行的向量化请求数
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', str(min(4, os.cpu_count() or 1))))
+EMBED_CONCURRENCY = int(os.environ.get('EMBED_CONCURRENCY', '4'))
+# 不小于该大小（字节）的文件不交给进程池，在读取线程中边切割边输出片段，内存占用与文件大小无关
+STREAM_FILE_SIZE = int(os.environ.get('STREAM_FILE_SIZE', str(8 * 1024 * 1024)))
+# 切割进程的启动方式：进程池在读取线程中创建，此时向量化线程池、写入线程和HTTP连接池都在运行，
+# fork可能复制其他线程持有的锁，因此优先使用forkserver，不支持时使用spawn
+INGEST_MP_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+# 向量化失败时的重试次数和退避时间（秒），每次重试等待时间翻倍
+EMBED_RETRIES = int(os.environ.get('EMBED_RETRIES', '5'))
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+# 入库进度日志：记录已写入的片段和已完成的文件，中断后重新运行时从日志处继续。
+# 日志与集合保存在同一个向量库中（NumPy后端在集合目录内，Chroma后端在向量库路径的该子目录下）
+JOURNAL_DIRNAME = 'ingest_journal'
+
+def content_hash(chunk):
+    """片段内容的哈希值（规范化后计算）"""
+    return hashlib.sha1(normalize_text(chunk).encode('utf-8')).hexdigest()
+
+def chunk_id(filename, chunk_hash, occurrence=0):
+    """由文件名和片段内容哈希生成确定的片段ID；同一文件中内容相同的片段用出现序号区分"""
+    key = f"{filename}\0{chunk_hash}\0{occurrence}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def iter_file_records(filename, chunks, source=SOURCE):
+    """为一个文件的片段逐个生成ID和元数据，返回 {'id', 'document', 'metadata'}
+
+    片段可以是文本，也可以是chunker切割出的 {'text', 'headings'}，标题路径以 " > " 连接保存在元数据中。
+    chunks可以是生成器，片段在切割出来后立即输出。
+    """
+    occurrences = {}
+    for i, chunk in enumerate(chunks):
+        headings = None
+        if isinstance(chunk, dict):
+            headings = chunk.get('headings')
+            chunk = chunk['text']
+        chunk_hash = content_hash(chunk)
+        occurrence = occurrences.get(chunk_hash, 0)
+        occurrences[chunk_hash] = occurrence + 1
+        metadata = {
+            "source": source,
+            "filename": filename,
+            "chunk_index": i,
+            "content_hash": chunk_hash
+        }
+        if headings:
+            metadata["headings"] = " > ".join(headings)
+        yield {
+            'id': chunk_id(filename, chunk_hash, occurrence),
+            'document': chunk,
+            'metadata': metadata
+        }
+
+def build_file_chunks(filename, chunks, source=SOURCE):
+    """为一个文件的片段生成ID和元数据，返回 [{'id', 'document', 'metadata'}, ...]"""
+    return list(iter_file_records(filename, chunks, source))
+
+def chunk_file(process_file, knowledge_dir, filename, source=SOURCE):
+    """切割单个文件并生成片段记录（可在子进程中执行），返回 (文件名, 记录列表)"""
+    return filename, build_file_chunks(filename, process_file(os.path.join(knowledge_dir, filename)), source)
+
+def stream_file(process_file, knowledge_dir, filename, source=SOURCE):
+    """在当前进程中切割单个文件，返回 (文件名, 记录生成器)"""
+    return filename, iter_file_records(filename, process_file(os.path.join(knowledge_dir, filename)), source)
+
+def iter_chunked_files(knowledge_dir, filenames, process_file, source=SOURCE, workers=INGEST_WORKERS):
+    """按文件顺序逐个返回 (文件名, 记录)，记录为列表或生成器，需在取下一个文件前读完
+
+    workers不大于1时在当前进程中边切割边输出；否则在进程池中并行切割，同时最多提交workers * 2个文件，
+    避免切割结果堆积在内存中，不小于STREAM_FILE_SIZE的大文件仍在当前进程中流式切割。
+    """
+    if workers <= 1 or len(filenames) <= 1:
+        for filename in filenames:
+            yield stream_file(process_file, knowledge_dir, filename, source)
+        return
+    with ProcessPoolExecutor(max_workers=workers, mp_context=INGEST_MP_CONTEXT) as executor:
+        pending = deque()
+        for filename in filenames:
+            if os.path.getsize(os.path.join(knowledge_dir, filename)) >= STREAM_FILE_SIZE:
+                # 先按顺序输出已提交的文件
+                while pending:
+                    yield pending.popleft().result()
+                yield stream_file(process_file, knowledge_dir, filename, source)
+                continue
+            pending.append(executor.submit(chunk_file, process_file, knowledge_dir, filename, source))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def embed_in_parallel(items, concurrency=EMBED_CONCURRENCY, embed_fn=embed_texts):
+    """并发计算多批文本的向量，按输入顺序返回 (附带数据, 向量列表)
+
+    items为 (文本列表, 附带数据) 的可迭代对象，同时最多有concurrency * 2批在处理中，
+    上游生产过快时在此阻塞（背压）。文本列表为None的项不计算向量，原样按顺序返回。
+    """
+    if concurrency <= 1:
+        for texts, payload in items:
+            yield payload, (embed_fn(texts) if texts is not None else None)
+        return
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        for texts, payload in items:
+            pending.append((payload, executor.submit(embed_fn, texts) if texts is not None else None))
+            while len(pending) >= concurrency * 2 or (pending and pending[0][1] is not None and pending[0][1].done()):
+                payload_done, future = pending.popleft()
+                yield payload_done, (future.result() if future is not None else None)
+        while pending:
+            payload_done, future = pending.popleft()
+            yield payload_done, (future.result() if future is not None else None)
+
+def embed_with_retry(texts, retries=EMBED_RETRIES):
+    """向量化一批文本，失败时按指数退避重试，重试次数用完后抛出异常"""
+    for attempt in range(retries + 1):
+        try:
+            return embed_texts(texts)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.8, 1.2)
+            print(f"向量化失败（第 {attempt + 1} 次）: {e}，{delay:.1f} 秒后重试")
+            time.sleep(delay)
+
+# 入库进度日志
+def journal_path(collection, path=DB_PATH):
+    """集合对应的进度日志文件路径，path为集合所在的向量库路径
+
+    NumPy集合的日志放在集合目录中，随集合一起删除；Chroma集合的日志以集合ID命名，
+    集合删除重建后ID改变，不会沿用属于其他向量库或旧集合的日志。
+    """
+    if isinstance(collection, NumpyCollection):
+        return os.path.join(collection.directory, f"{JOURNAL_DIRNAME}.jsonl")
+    return os.path.join(path, JOURNAL_DIRNAME, f"{collection.name}.{collection.id}.jsonl")
+
+def remove_stale_journals(collection, path=DB_PATH):
+    """删除同名集合删除重建之前留下的进度日志"""
+    if isinstance(collection, NumpyCollection):
+        return
+    directory = os.path.join(path, JOURNAL_DIRNAME)
+    current = os.path.basename(journal_path(collection, path))
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            if filename.rsplit('.', 2)[0] == collection.name and filename != current:
+                os.remove(os.path.join(directory, filename))
+
+def load_journal(path):
+    """读取上次未完成的进度日志，返回 (已写入的片段ID集合, 已完成的文件 {文件名: (大小, 修改时间)})"""
+    completed_ids = set()
+    completed_files = {}
+    if not os.path.exists(path):
+        return completed_ids, completed_files
+    with open(path, encoding='utf-8') as fp:
+        for line in fp:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break  # 中断时最后一行可能不完整
+            if entry.get('done'):
+                completed_files[entry['file']] = (entry['size'], entry['mtime'])
+            else:
+                completed_ids.add(entry['id'])
+    print(f"从进度日志继续: 已完成 {len(completed_files)} 个文件，{len(completed_ids)} 个片段")
+    return completed_ids, completed_files
+
+def append_journal(fp, entries):
+    """追加一批日志并落盘"""
+    fp.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries))
+    fp.flush()
+    os.fsync(fp.fileno())
+
+def file_signature(knowledge_dir, filename):
+    """文件的大小和修改时间，用于判断日志中已完成的文件是否有变化"""
+    stat = os.stat(os.path.join(knowledge_dir, filename))
+    return stat.st_size, stat.st_mtime_ns
+
+def get_existing_filenames(collection, source=SOURCE):
+    """分页读取集合中指定来源的文档所属的文件名集合"""
+    filenames = set()
+    offset = 0
+    while True:
+        result = collection.get(where={"source": source}, include=["metadatas"],
+                                limit=SYNC_BATCH_SIZE, offset=offset)
+        filenames.update((metadata or {}).get('filename') for metadata in result['metadatas'])
+        if len(result['ids']) < SYNC_BATCH_SIZE:
+            break
+        offset += SYNC_BATCH_SIZE
+    filenames.discard(None)
+    return filenames
+
+def get_file_metadata(collection, filename, source=SOURCE):
+    """读取集合中某个文件的所有片段ID和元数据，返回 {ID: 元数据}"""
+    result = collection.get(where={"$and": [{"source": source}, {"filename": filename}]}, include=["metadatas"])
+    return {doc_id: metadata or {} for doc_id, metadata in zip(result['ids'], result['metadatas'])}
+
+def put_item(queue, item, stop_event):
+    """向有界队列放入数据，队列满时阻塞等待；流水线已中止时返回False"""
+    while not stop_event.is_set():
+        try:
+            queue.put(item, timeout=0.5)
+            return True
+        except Full:
+            continue
+    return False
+
+def get_item(queue, stop_event):
+    """从队列取出数据；流水线已中止时返回结束标记"""
+    while not stop_event.is_set():
+        try:
+            return queue.get(timeout=0.5)
+        except Empty:
+            continue
+    return None
+
+def read_stage(collection, knowledge_dir, process_file, source, out_queue, stop_event, stats, workers, journal):
+    """读取阶段：逐个文件切割并与集合中的记录对比，输出写入操作
+
+    输出 ('add', 记录)、('update', [记录, ...])、('delete', [ID, ...])，每个文件结束时输出
+    ('file_done', 文件名, 大小, 修改时间)，最后输出None表示结束。journal为上次中断时的进度日志，
+    日志中已完成且未修改的文件直接跳过，已写入的片段不再计算向量。
+    """
+    completed_ids, completed_files = journal
+    txt_files = sorted(f for f in os.listdir(knowledge_dir) if f.endswith(".txt"))
+    print(f"找到 {len(txt_files)} 个文本文件")
+    signatures = {filename: file_signature(knowledge_dir, filename) for filename in txt_files}
+    resumed = [f for f in txt_files if completed_files.get(f) == signatures[f]]
+    stats['resumed'] = len(resumed)
+    txt_files = [f for f in txt_files if completed_files.get(f) != signatures[f]]
+
+    # 文件夹中已不存在的文件，删除其全部片段
+    for filename in sorted(get_existing_filenames(collection, source) - set(signatures)):
+        doc_ids = list(get_file_metadata(collection, filename, source))
+        stats['deleted'] += len(doc_ids)
+        if not put_item(out_queue, ('delete', doc_ids), stop_event):
+            return
+
+    for filename, records in iter_chunked_files(knowledge_dir, txt_files, process_file, source, workers):
+        existing = get_file_metadata(collection, filename, source)
+        # 记录可能是生成器，逐个处理，只保留ID集合和待更新的一批记录
+        new_ids = set()
+        to_update = []
+        for record in records:
+            stats['total'] += 1
+            new_ids.add(record['id'])
+            if record['id'] in existing:
+                if existing[record['id']] != record['metadata']:
+                    to_update.append(record)
+                    if len(to_update) >= SYNC_BATCH_SIZE:
+                        stats['updated'] += len(to_update)
+                        if not put_item(out_queue, ('update', to_update), stop_event):
+                            return
+                        to_update = []
+            elif record['id'] not in completed_ids:
+                stats['added'] += 1
+                if not put_item(out_queue, ('add', record), stop_event):
+                    return
+        stats['updated'] += len(to_update)
+        if to_update and not put_item(out_queue, ('update', to_update), stop_event):
+            return
+        to_delete = [doc_id for doc_id in existing if doc_id not in new_ids]
+        stats['deleted'] += len(to_delete)
+        if to_delete and not put_item(out_queue, ('delete', to_delete), stop_event):
+            return
+        if not put_item(out_queue, ('file_done', filename) + signatures[filename], stop_event):
+            return
+    put_item(out_queue, None, stop_event)
+
+def iter_embed_batches(in_queue, stop_event, batch_size):
+    """从队列读取操作，新增片段凑满一批后输出 (文本列表, 记录列表)，其余操作输出 (None, 操作)
+
+    文件完成标记排在该文件最后一批片段之后输出，保证写入日志时文件的片段都已写入。
+    """
+    batch = []
+    deferred = []
+    while True:
+        item = get_item(in_queue, stop_event)
+        if item is None or item[0] == 'add':
+            if item is not None:
+                batch.append(item[1])
+            if batch and (item is None or len(batch) >= batch_size):
+                yield [record['document'] for record in batch], batch
+                batch = []
+                for marker in deferred:
+                    yield None, marker
+                deferred = []
+            if item is None:
+                return
+        elif item[0] == 'file_done' and batch:
+            deferred.append(item)
+        else:
+            yield None, item
+
+def embed_stage(in_queue, out_queue, stop_event, batch_size, concurrency):
+    """向量化阶段：新增片段按批并发计算向量，按提交顺序输出 ('upsert', [记录, ...], [向量, ...])，其余操作直接转发"""
+    batches = iter_embed_batches(in_queue, stop_event, batch_size)
+    for payload, embeddings in embed_in_parallel(batches, concurrency, embed_fn=embed_with_retry):
+        item = ('upsert', payload, embeddings) if embeddings is not None else payload
+        if not put_item(out_queue, item, stop_event):
+            return
+    if not stop_event.is_set():
+        put_item(out_queue, None, stop_event)
+
+def write_stage(collection, in_queue, stop_event, stats, journal_fp):
+    """写入阶段：按批次写入向量库，与向量化并行进行；每批写入后追加进度日志"""
+    while True:
+        item = get_item(in_queue, stop_event)
+        if item is None:
+            return
+        if item[0] == 'file_done':
+            append_journal(journal_fp, [{'file': item[1], 'size': item[2], 'mtime': item[3], 'done': True}])
+        elif item[0] == 'delete':
+            for start in range(0, len(item[1]), SYNC_BATCH_SIZE):
+                collection.delete(ids=item[1][start:start + SYNC_BATCH_SIZE])
+        elif item[0] == 'update':
+            collection.update(ids=[r['id'] for r in item[1]], metadatas=[r['metadata'] for r in item[1]])
+        else:
+            records, embeddings = item[1], item[2]
+            collection.upsert(
+                ids=[r['id'] for r in records],
+                documents=[r['document'] for r in records],
+                embeddings=embeddings,
+                metadatas=[r['metadata'] for r in records]
+            )
+            append_journal(journal_fp, [{'file': r['metadata']['filename'], 'hash': r['metadata']['content_hash'],
+                                         'id': r['id']} for r in records])
+            stats['written'] += len(records)
+            print(f"已写入 {stats['written']} 个片段")
+
+def run_stage(target, args, stop_event, errors):
+    """执行流水线的一个阶段，出错时记录异常并中止整个流水线"""
+    try:
+        target(*args)
+    except Exception as e:
+        errors.append(e)
+        stop_event.set()
+
+def sync_collection(collection, knowledge_dir, process_file, source=SOURCE,
+                    batch_size=PIPELINE_BATCH_SIZE, queue_size=PIPELINE_QUEUE_SIZE,
+                    workers=INGEST_WORKERS, concurrency=EMBED_CONCURRENCY, resume=True, path=DB_PATH):
+    """将文件夹内容增量同步到向量集合：只为新增片段计算向量并写入，删除已不存在的片段，
+    片段位置变化时只更新元数据。返回各类操作的数量
+
+    读取切割、向量化、写入三个阶段通过有界队列连接并行执行，内存中最多只有少量文件的片段
+    和待写入的批次，与语料总量无关。切割在workers个进程中进行，向量化同时发出concurrency个请求，
+    写入顺序与文件和片段顺序一致。
+
+    每批写入后将完成的片段和文件追加到进度日志，向量化失败按指数退避重试；运行中断后再次调用时
+    （resume为True）跳过日志中已完成的文件，同步成功后删除日志。path为打开集合时使用的向量库路径，日志保存在其中。
+    """
+    stats = {'added': 0, 'deleted': 0, 'updated': 0, 'total': 0, 'written': 0, 'resumed': 0}
+    journal_file = journal_path(collection, path)
+    remove_stale_journals(collection, path)
+    journal = load_journal(journal_file) if resume else (set(), {})
+    os.makedirs(os.path.dirname(journal_file), exist_ok=True)
+    journal_fp = open(journal_file, 'a' if resume else 'w', encoding='utf-8')
+    chunk_queue = Queue(maxsize=batch_size * queue_size)
+    write_queue = Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    errors = []
+
+    threads = [
+        threading.Thread(target=run_stage, daemon=True, args=(
+            read_stage, (collection, knowledge_dir, process_file, source, chunk_queue, stop_event, stats, workers,
+                         journal),
+            stop_event, errors)),
+        threading.Thread(target=run_stage, daemon=True, args=(
+            embed_stage, (chunk_queue, write_queue, stop_event, batch_size, concurrency), stop_event, errors))
+    ]
+    for thread in threads:
+        thread.start()
+    run_stage(write_stage, (collection, write_queue, stop_event, stats, journal_fp), stop_event, errors)
+    for thread in threads:
+        thread.join()
+    journal_fp.close()
+    if stats['written'] or stats['deleted'] or stats['updated']:
+        # 集合内容改变，缓存的检索结果和回答失效
+        semantic_cache.invalidate(collection.name)
+    if errors:
+        print(f"同步中断，已写入的进度保存在 {journal_file}，重新运行将从中断处继续")
+        raise errors[0]
+    flush(collection)
+    os.remove(journal_file)
+
+    print(f"同步向量集合: 新增 {stats['added']} 个，删除 {stats['deleted']} 个，更新元数据 {stats['updated']} 个，"
+          f"未变化 {stats['total'] - stats['added'] - stats['updated']} 个，从日志跳过 {stats['resumed']} 个文件")
+    return stats
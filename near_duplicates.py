@@ -0,0 +1,145 @@
+import os
+import re
+from collections import OrderedDict
+import numpy as np
+
+# 近重复检测：文本切成字符k-gram（shingle），MinHash签名估计Jaccard相似度，LSH分段只比较候选对，
+# 候选对再用完整的shingle集合计算精确的Jaccard相似度。
+# 签名使用单次哈希的MinHash：shingle哈希值按最高几位分到各个桶，每个桶取最小值，只需哈希一次
+# 每个shingle的字符数
+SHINGLE_SIZE = 5
+# MinHash签名的长度（桶数，必须是2的幂），越大估计越准
+MINHASH_PERMUTATIONS = 128
+# shingle集合的Jaccard相似度不低于该值时视为重复
+DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', '0.7'))
+# 选择LSH参数时误报相对于漏报的权重
+FALSE_POSITIVE_WEIGHT = 0.1
+# 精确比较时缓存的shingle集合数
+SHINGLE_CACHE_SIZE = 256
+
+MARKUP_PATTERN = re.compile(r'^#+|===', re.MULTILINE)
+
+def normalize_for_shingles(text):
+    """去掉Markdown标题标记、===分隔符和所有空白，英文转小写"""
+    return ''.join(MARKUP_PATTERN.sub('', text).split()).lower()
+
+def shingle_set(text, size=SHINGLE_SIZE):
+    """文本的shingle哈希集合，返回排序去重后的uint64数组；文本短于size时整段作为一个shingle"""
+    text = normalize_for_shingles(text)
+    if not text:
+        return np.zeros(0, dtype=np.uint64)
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    size = min(size, len(codes))
+    # 多项式滚动哈希，uint64溢出即取模
+    hashes = np.zeros(len(codes) - size + 1, dtype=np.uint64)
+    for j in range(size):
+        hashes = hashes * np.uint64(1000003) + codes[j:len(codes) - size + 1 + j]
+    # 打散低位，使相近的shingle哈希值相差较大
+    hashes ^= hashes >> np.uint64(31)
+    hashes *= np.uint64(0x9E3779B97F4A7C15)
+    hashes ^= hashes >> np.uint64(29)
+    hashes.sort()
+    return hashes[np.concatenate(([True], hashes[1:] != hashes[:-1]))]
+
+def minhash_signature(shingles, num_perm=MINHASH_PERMUTATIONS):
+    """排序后的shingle哈希集合的MinHash签名（uint64数组）
+
+    哈希值的最高几位决定所在的桶，排序后每个桶的第一个值即桶内最小值；
+    空桶借用右侧（循环）最近的非空桶的值并加上距离，使两个集合的空桶也能按相同规则比较。
+    """
+    bits = num_perm.bit_length() - 1
+    starts = np.arange(num_perm, dtype=np.uint64) << np.uint64(64 - bits) if bits else np.zeros(1, dtype=np.uint64)
+    index = np.searchsorted(shingles, starts)
+    ends = np.append(index[1:], len(shingles))
+    filled = index < ends
+    signature = np.zeros(num_perm, dtype=np.uint64)
+    signature[filled] = shingles[index[filled]]
+    if not filled.all():
+        nonempty = np.flatnonzero(filled)
+        position = np.arange(num_perm)
+        nearest = nonempty[np.searchsorted(nonempty, position) % len(nonempty)]
+        distance = (nearest - position) % num_perm
+        signature = np.where(filled, signature, signature[nearest] + distance.astype(np.uint64))
+    return signature
+
+def lsh_bands(threshold, num_perm=MINHASH_PERMUTATIONS):
+    """选择LSH的分段数和每段行数 (bands, rows)，使相似度低于阈值的误报与高于阈值的漏报的加权和最小
+
+    候选对都会精确比较，误报只多一次比较，漏报则漏掉重复文本，因此漏报的权重更高。
+    """
+    grid, step = np.linspace(0, 1, 201, retstep=True)
+    best = None
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            # 相似度为s的两个签名至少有一段完全相同的概率
+            probability = 1 - (1 - grid ** rows) ** bands
+            below = grid <= threshold
+            error = (probability[below].sum() * FALSE_POSITIVE_WEIGHT + (1 - probability[~below]).sum()) * step
+            if best is None or error < best[0]:
+                best = (error, bands, rows)
+    return best[1], best[2]
+
+def shingle_jaccard(a, b):
+    """两个shingle集合的精确Jaccard相似度"""
+    if not len(a) or not len(b):
+        return 0.0
+    common = len(np.intersect1d(a, b, assume_unique=True))
+    return common / (len(a) + len(b) - common)
+
+def find_near_duplicates(keys, load_text, times, threshold=None, num_perm=MINHASH_PERMUTATIONS):
+    """查找近重复的文本，每组保留时间最新的一个
+
+    keys为文本的标识（如文件名），load_text(key)返回文本内容，times[key]为文本的时间。
+    文本读取两次：第一次计算MinHash签名后丢弃，第二次只读取LSH候选对做精确比较，内存占用与文本总量无关。
+    从最新的文本开始，与其相似度不低于threshold的较旧文本归入该组，已归入其他组的文本不再保留。
+    返回 [(保留的文本, [(重复的文本, 相似度), ...]), ...]，按保留文本的时间从新到旧排列。
+    """
+    threshold = DEDUP_THRESHOLD if threshold is None else threshold
+    bands, rows = lsh_bands(threshold, num_perm)
+    order = sorted(keys, key=lambda key: (-times[key], key))
+
+    # 每段签名相同的文本进入同一个桶
+    buckets = [{} for _ in range(bands)]
+    signatures = {}
+    for key in order:
+        shingles = shingle_set(load_text(key))
+        if not len(shingles):
+            continue
+        signature = minhash_signature(shingles, num_perm)
+        signatures[key] = signature
+        for band in range(bands):
+            buckets[band].setdefault(signature[band * rows:(band + 1) * rows].tobytes(), []).append(key)
+
+    cache = OrderedDict()
+    def cached_shingles(key):
+        if key in cache:
+            cache.move_to_end(key)
+        else:
+            cache[key] = shingle_set(load_text(key))
+            while len(cache) > SHINGLE_CACHE_SIZE:
+                cache.popitem(last=False)
+        return cache[key]
+
+    position = {key: i for i, key in enumerate(order)}
+    removed = set()
+    groups = []
+    for key in order:
+        if key in removed or key not in signatures:
+            continue
+        signature = signatures[key]
+        candidates = set()
+        for band in range(bands):
+            candidates.update(buckets[band][signature[band * rows:(band + 1) * rows].tobytes()])
+        # 较新的文本已经处理过，只比较较旧且未被归组的文本
+        candidates = sorted((c for c in candidates if position[c] > position[key] and c not in removed),
+                            key=position.get)
+        duplicates = []
+        shingles = cached_shingles(key) if candidates else None
+        for candidate in candidates:
+            similarity = shingle_jaccard(shingles, cached_shingles(candidate))
+            if similarity >= threshold:
+                duplicates.append((candidate, similarity))
+                removed.add(candidate)
+        if duplicates:
+            groups.append((key, duplicates))
+    return groups
@@ -0,0 +1,189 @@
+import os
+import json
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import embedding_cache
+import response_cache
+
+# Ollama服务地址和默认模型，可通过环境变量覆盖
+OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://127.0.0.1:11434')
+EMBED_MODEL = os.environ.get('EMBED_MODEL', 'nomic-embed-text')
+GENERATE_MODEL = os.environ.get('GENERATE_MODEL', 'deepseek-r1:1.5b')
+
+# 超时设置（秒）：连接超时较短，读取超时需覆盖模型加载和长文本生成
+CONNECT_TIMEOUT = float(os.environ.get('OLLAMA_CONNECT_TIMEOUT', '5'))
+READ_TIMEOUT = float(os.environ.get('OLLAMA_READ_TIMEOUT', '300'))
+
+# 批量向量化：单个请求最多包含的文本数和总字符数，超过时自动拆分为多个请求
+EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', '64'))
+EMBED_BATCH_CHARS = int(os.environ.get('EMBED_BATCH_CHARS', '32000'))
+
+# 连接池大小，需不小于并发请求的线程数
+POOL_SIZE = int(os.environ.get('OLLAMA_POOL_SIZE', '16'))
+
+# 进程内共享的HTTP会话，复用keep-alive连接
+session = None
+session_lock = threading.Lock()
+
+# 服务端不支持 /api/embed（旧版本Ollama）时退回逐条调用 /api/embeddings
+embed_endpoint_supported = True
+
+def get_session():
+    """获取共享的HTTP会话，首次调用时创建连接池"""
+    global session
+    if session is None:
+        with session_lock:
+            if session is None:
+                new_session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+                new_session.mount('http://', adapter)
+                new_session.mount('https://', adapter)
+                session = new_session
+    return session
+
+def post(path, payload, stream=False):
+    """向Ollama发送POST请求，返回响应对象，HTTP错误时抛出异常"""
+    response = get_session().post(
+        url=f"{OLLAMA_URL}{path}",
+        json=payload,
+        stream=stream,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+    )
+    response.raise_for_status()
+    return response
+
+def split_batches(texts, batch_size=EMBED_BATCH_SIZE, batch_chars=EMBED_BATCH_CHARS):
+    """按文本数和总字符数将文本拆分为批次，返回 [(起始位置, 文本列表), ...]"""
+    batches = []
+    start = 0
+    current = []
+    current_chars = 0
+    for i, text in enumerate(texts):
+        if current and (len(current) >= batch_size or current_chars + len(text) > batch_chars):
+            batches.append((start, current))
+            start, current, current_chars = i, [], 0
+        current.append(text)
+        current_chars += len(text)
+    if current:
+        batches.append((start, current))
+    return batches
+
+def embed_batch(texts, model):
+    """调用 /api/embed 一次向量化多条文本；请求失败时对半拆分重试，单条仍失败则抛出异常"""
+    global embed_endpoint_supported
+    if not embed_endpoint_supported:
+        return [embed_legacy(text, model) for text in texts]
+    try:
+        response = post('/api/embed', {"model": model, "input": texts})
+        return response.json()['embeddings']
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404 and 'model' not in e.response.text:
+            # 旧版本Ollama没有 /api/embed 接口
+            print("Ollama不支持 /api/embed，改为逐条调用 /api/embeddings")
+            embed_endpoint_supported = False
+            return [embed_legacy(text, model) for text in texts]
+        if len(texts) == 1:
+            raise
+    except requests.Timeout:
+        if len(texts) == 1:
+            raise
+    # 批次过大导致失败时拆小后重试
+    middle = len(texts) // 2
+    return embed_batch(texts[:middle], model) + embed_batch(texts[middle:], model)
+
+def embed_legacy(text, model):
+    """调用旧接口 /api/embeddings 向量化单条文本"""
+    response = post('/api/embeddings', {"model": model, "prompt": text})
+    return response.json()['embedding']
+
+def embed_texts(texts, model=EMBED_MODEL, batch_size=EMBED_BATCH_SIZE, use_cache=True):
+    """批量获取文本的向量表示，按输入顺序返回向量列表
+
+    启用向量缓存时先查缓存，只对未命中的文本调用模型，同一批中的重复文本只计算一次。
+    """
+    texts = list(texts)
+    if not (use_cache and embedding_cache.cache_enabled()):
+        embeddings = []
+        for start, batch in split_batches(texts, batch_size):
+            embeddings.extend(embed_batch(batch, model))
+        return embeddings
+
+    embeddings = embedding_cache.get_embeddings(model, texts)
+    # 未命中的文本按缓存键去重
+    missing = {}
+    for i, embedding in enumerate(embeddings):
+        if embedding is None:
+            missing.setdefault(embedding_cache.text_key(texts[i]), []).append(i)
+    if missing:
+        missing_texts = [texts[positions[0]] for positions in missing.values()]
+        new_embeddings = []
+        for start, batch in split_batches(missing_texts, batch_size):
+            new_embeddings.extend(embed_batch(batch, model))
+        embedding_cache.put_embeddings(model, missing_texts, new_embeddings)
+        for positions, embedding in zip(missing.values(), new_embeddings):
+            for i in positions:
+                embeddings[i] = embedding
+    return embeddings
+
+def embed_text(text, model=EMBED_MODEL, use_cache=True):
+    """获取单条文本的向量表示"""
+    return embed_texts([text], model, use_cache=use_cache)[0]
+
+def generate(prompt, model=GENERATE_MODEL, temperature=0.1, use_cache=True):
+    """生成文本回复，等待生成完成后返回完整文本；启用回复缓存时相同的提示词直接返回缓存的回复"""
+    def compute():
+        response = post('/api/generate', {
+            "model": model,
+            "prompt": prompt,
+            "stream": False,
+            "temperature": temperature
+        })
+        return response.json()['response']
+
+    if not (use_cache and response_cache.cache_enabled()):
+        return compute()
+    return response_cache.cached_call(response_cache.response_key(model, prompt, {'temperature': temperature}), compute)
+
+def generate_stream(prompt, model=GENERATE_MODEL, temperature=0.1, use_cache=True):
+    """流式生成文本回复，逐段返回生成的文本
+
+    启用回复缓存时相同的提示词一次返回缓存的完整回复；相同的提示词正在生成时等待其完成后返回缓存结果。
+    """
+    if not (use_cache and response_cache.cache_enabled()):
+        yield from stream_generate(prompt, model, temperature)
+        return
+    key = response_cache.response_key(model, prompt, {'temperature': temperature})
+    cached, leader = response_cache.lookup_or_lead(key)
+    if not leader:
+        yield cached
+        return
+    try:
+        parts = []
+        for text in stream_generate(prompt, model, temperature):
+            parts.append(text)
+            yield text
+        # 只缓存完整生成的回复，中途中断（出错或调用方停止读取）时不写入
+        response_cache.put_response(key, "".join(parts))
+    finally:
+        response_cache.release(key)
+
+def stream_generate(prompt, model=GENERATE_MODEL, temperature=0.1):
+    """调用 /api/generate 流式接口，逐段返回生成的文本"""
+    with post('/api/generate', {
+        "model": model,
+        "prompt": prompt,
+        "stream": True,
+        "temperature": temperature
+    }, stream=True) as response:
+        # Ollama按行返回JSON（NDJSON），每行包含一段新生成的文本
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get('error'):
+                raise RuntimeError(chunk['error'])
+            if chunk.get('response'):
+                yield chunk['response']
+            if chunk.get('done'):
+                break
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 模型回复缓存：以 (模型名, 生成参数, 完整提示词) 的哈希为键，相同的提示词不再重复生成
+# 内存中最多保存的回复数，按最近使用淘汰；设为0关闭缓存
+MEMORY_ENTRIES = int(os.environ.get('RESPONSE_CACHE_SIZE', '1000'))
+# 磁盘缓存的路径，为空时只使用内存缓存（如 db/response_cache.sqlite）
+DISK_PATH = os.environ.get('RESPONSE_CACHE_PATH', '')
+# 磁盘缓存的条目上限，超过后按最近使用时间淘汰
+DISK_ENTRIES = int(os.environ.get('RESPONSE_CACHE_DISK_ENTRIES', '100000'))
+# 每次淘汰时额外删除的比例，避免每次写入都触发淘汰
+EVICT_FRACTION = 0.05
+
+memory = OrderedDict()
+memory_lock = threading.Lock()
+
+connection = None
+connection_lock = threading.Lock()
+# 磁盘缓存条目数的估计值：写入时加1（覆盖已有条目时偏大），超过上限时才重新统计
+disk_count = None
+
+# 正在生成的请求：相同的请求同时到达时只生成一次，其余请求等待结果
+inflight = {}
+inflight_lock = threading.Lock()
+
+counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'waits': 0}
+
+def cache_enabled():
+    """是否启用回复缓存"""
+    return MEMORY_ENTRIES > 0
+
+def response_key(model, prompt, options=None):
+    """模型名、生成参数和提示词的哈希值"""
+    payload = json.dumps({'model': model, 'options': options or {}, 'prompt': prompt},
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def get_connection():
+    """获取磁盘缓存的数据库连接，首次调用时建表；未配置磁盘缓存时返回None"""
+    global connection
+    if not DISK_PATH:
+        return None
+    if connection is None:
+        os.makedirs(os.path.dirname(os.path.abspath(DISK_PATH)), exist_ok=True)
+        conn = sqlite3.connect(DISK_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used)")
+        conn.commit()
+        connection = conn
+    return connection
+
+def remember(key, response):
+    """写入内存缓存，超过上限时淘汰最久未使用的条目"""
+    with memory_lock:
+        memory[key] = response
+        memory.move_to_end(key)
+        while len(memory) > MEMORY_ENTRIES:
+            memory.popitem(last=False)
+
+def get_response(key):
+    """依次查询内存缓存和磁盘缓存，磁盘命中的条目放回内存；未命中返回None"""
+    with memory_lock:
+        response = memory.get(key)
+        if response is not None:
+            memory.move_to_end(key)
+            counters['memory_hits'] += 1
+            return response
+    with connection_lock:
+        conn = get_connection()
+        if conn is None:
+            return None
+        row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        conn.commit()
+        counters['disk_hits'] += 1
+    remember(key, row[0])
+    return row[0]
+
+def put_response(key, response):
+    """写入内存缓存和磁盘缓存"""
+    global disk_count
+    remember(key, response)
+    with connection_lock:
+        conn = get_connection()
+        if conn is None:
+            return
+        conn.execute("INSERT OR REPLACE INTO responses (key, response, last_used) VALUES (?, ?, ?)",
+                     (key, response, time.time()))
+        conn.commit()
+        if disk_count is not None:
+            disk_count += 1
+            if disk_count <= DISK_ENTRIES:
+                return
+        (disk_count,) = conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if disk_count > DISK_ENTRIES:
+            excess = disk_count - DISK_ENTRIES + int(DISK_ENTRIES * EVICT_FRACTION)
+            conn.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)", (excess,))
+            conn.commit()
+            disk_count -= excess
+
+def lookup_or_lead(key):
+    """查询缓存；未命中且已有相同的请求在生成时等待其完成
+
+    返回 (缓存的回复, 是否由当前线程生成)，当前线程负责生成时完成后必须调用release(key)。
+    正在生成的请求失败时，等待的请求之一接替生成。
+    """
+    while True:
+        response = get_response(key)
+        if response is not None:
+            return response, False
+        with inflight_lock:
+            event = inflight.get(key)
+            if event is None:
+                inflight[key] = threading.Event()
+                counters['misses'] += 1
+                return None, True
+            counters['waits'] += 1
+        event.wait()
+
+def release(key):
+    """生成结束（成功或失败），唤醒等待相同请求的线程"""
+    with inflight_lock:
+        event = inflight.pop(key, None)
+    if event is not None:
+        event.set()
+
+def cached_call(key, compute):
+    """返回缓存的回复，未命中时调用compute()生成并写入缓存；相同的并发请求只生成一次"""
+    response, leader = lookup_or_lead(key)
+    if not leader:
+        return response
+    try:
+        response = compute()
+        put_response(key, response)
+        return response
+    finally:
+        release(key)
+
+def cache_stats():
+    """返回命中、未命中、等待相同请求的次数和各层的条目数"""
+    stats = dict(counters)
+    with memory_lock:
+        stats['memory_entries'] = len(memory)
+    with connection_lock:
+        conn = get_connection()
+        stats['disk_entries'] = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] if conn else 0
+    return stats
+
+def clear_cache():
+    """清空内存缓存和磁盘缓存"""
+    global disk_count
+    with memory_lock:
+        memory.clear()
+    with connection_lock:
+        conn = get_connection()
+        if conn is not None:
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+            disk_count = 0
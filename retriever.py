@@ -0,0 +1,62 @@
+import threading
+import vector_store
+import semantic_cache
+from ollama_client import EMBED_MODEL, embed_texts
+from vector_store import DB_PATH
+
+# 默认的集合
+DEFAULT_COLLECTION = "all_knowledge_collection"
+
+# 进程内复用的集合句柄，避免每次查询重新打开数据库和加载数据
+collections = {}
+retriever_lock = threading.Lock()
+
+def get_collection(collection_name=DEFAULT_COLLECTION, path=DB_PATH):
+    """获取共享的集合句柄（后端由VECTOR_BACKEND决定），首次调用时打开数据库"""
+    key = (path, collection_name, vector_store.VECTOR_BACKEND)
+    collection = collections.get(key)
+    if collection is None:
+        with retriever_lock:
+            collection = collections.get(key)
+            if collection is None:
+                collection = vector_store.get_collection(collection_name, path, create=False)
+                collections[key] = collection
+    return collection
+
+def reset_collections():
+    """清除缓存的集合句柄和语义缓存（集合被删除重建后调用）"""
+    with retriever_lock:
+        collections.clear()
+    semantic_cache.invalidate()
+
+def search_many(query_embeddings, k=3, collection_name=DEFAULT_COLLECTION, path=DB_PATH):
+    """按已有的查询向量批量检索，按查询顺序返回结果列表
+
+    每个查询的结果为 [{'id', 'document', 'metadata', 'distance'}, ...]，按距离从小到大排列。
+    """
+    query_embeddings = list(query_embeddings)
+    if not query_embeddings:
+        return []
+    collection = get_collection(collection_name, path)
+    results = collection.query(query_embeddings=query_embeddings, n_results=k)
+    return [
+        [{'id': doc_id, 'document': document, 'metadata': metadata or {}, 'distance': distance}
+         for doc_id, document, metadata, distance in zip(ids, documents, metadatas, distances)]
+        for ids, documents, metadatas, distances in zip(
+            results['ids'], results['documents'], results['metadatas'], results['distances'])
+    ]
+
+def search(query_embedding, k=3, collection_name=DEFAULT_COLLECTION, path=DB_PATH):
+    """按已有的查询向量检索最相似的k个片段"""
+    return search_many([query_embedding], k, collection_name, path)[0]
+
+def retrieve_many(queries, k=3, collection_name=DEFAULT_COLLECTION, path=DB_PATH, model=EMBED_MODEL):
+    """批量检索：所有查询一次向量化、一次近邻搜索，按查询顺序返回结果列表"""
+    queries = list(queries)
+    if not queries:
+        return []
+    return search_many(embed_texts(queries, model), k, collection_name, path)
+
+def retrieve(query, k=3, collection_name=DEFAULT_COLLECTION, path=DB_PATH, model=EMBED_MODEL):
+    """检索与查询最相似的k个片段，返回 [{'id', 'document', 'metadata', 'distance'}, ...]"""
+    return retrieve_many([query], k, collection_name, path, model)[0]
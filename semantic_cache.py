@@ -0,0 +1,104 @@
+import os
+import time
+import threading
+import numpy as np
+
+# 语义查询缓存：新查询与某条缓存查询的余弦相似度不低于阈值时，直接复用其检索结果和回答
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', '0.95'))
+# 每个集合最多缓存的查询数，超过后淘汰最久未使用的条目；设为0关闭缓存
+SEMANTIC_CACHE_SIZE = int(os.environ.get('SEMANTIC_CACHE_SIZE', '1000'))
+# 缓存条目的有效期（秒），其他进程重建向量库后最多在该时间内返回旧回答
+SEMANTIC_CACHE_TTL = float(os.environ.get('SEMANTIC_CACHE_TTL', '3600'))
+
+# 进程内按集合名共享的缓存
+caches = {}
+caches_lock = threading.Lock()
+
+class SemanticCache:
+    """保存最近查询的归一化向量（连续矩阵，一次矩阵乘法找到最相似的缓存查询）及对应的检索结果和回答"""
+
+    def __init__(self, threshold=None, max_entries=None, ttl=None):
+        self.threshold = SEMANTIC_CACHE_THRESHOLD if threshold is None else threshold
+        self.max_entries = SEMANTIC_CACHE_SIZE if max_entries is None else max_entries
+        self.ttl = SEMANTIC_CACHE_TTL if ttl is None else ttl
+        self.lock = threading.Lock()
+        self.vectors = None
+        self.queries = [None] * self.max_entries
+        self.values = [None] * self.max_entries
+        self.created = np.zeros(self.max_entries)
+        self.last_used = np.full(self.max_entries, -np.inf)  # -inf 表示空位
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def valid_slots(self, now):
+        return (self.last_used > -np.inf) & (now - self.created <= self.ttl)
+
+    def lookup(self, embedding):
+        """查找与查询向量最相似的缓存条目，命中时返回 {'query', 'value', 'similarity'}，否则返回None"""
+        vector = self.normalize(embedding)
+        with self.lock:
+            if self.vectors is None or self.vectors.shape[1] != len(vector):
+                self.misses += 1
+                return None
+            now = time.time()
+            scores = self.vectors @ vector
+            scores[~self.valid_slots(now)] = -np.inf
+            slot = int(np.argmax(scores))
+            if scores[slot] < self.threshold:
+                self.misses += 1
+                return None
+            self.last_used[slot] = now
+            self.hits += 1
+            return {'query': self.queries[slot], 'value': self.values[slot], 'similarity': float(scores[slot])}
+
+    def store(self, query, embedding, value):
+        """写入一条缓存，优先使用空位或过期条目，否则替换最久未使用的条目"""
+        if self.max_entries <= 0:
+            return
+        vector = self.normalize(embedding)
+        with self.lock:
+            if self.vectors is None or self.vectors.shape[1] != len(vector):
+                # 首次写入或向量模型改变时重新分配
+                self.vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+                self.last_used[:] = -np.inf
+            now = time.time()
+            free = np.flatnonzero(~self.valid_slots(now))
+            slot = int(free[0]) if len(free) else int(np.argmin(self.last_used))
+            self.vectors[slot] = vector
+            self.queries[slot] = query
+            self.values[slot] = value
+            self.created[slot] = now
+            self.last_used[slot] = now
+
+    def clear(self):
+        """清空缓存（向量库重建后调用）"""
+        with self.lock:
+            self.last_used[:] = -np.inf
+            self.queries = [None] * self.max_entries
+            self.values = [None] * self.max_entries
+
+    def stats(self):
+        """返回条目数和命中次数"""
+        with self.lock:
+            entries = int(self.valid_slots(time.time()).sum())
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses}
+
+def get_cache(name):
+    """获取集合对应的语义缓存，首次调用时创建"""
+    with caches_lock:
+        if name not in caches:
+            caches[name] = SemanticCache()
+        return caches[name]
+
+def invalidate(name=None):
+    """向量库内容改变后清空缓存，name为None时清空所有集合的缓存"""
+    with caches_lock:
+        targets = list(caches.values()) if name is None else [caches[name]] if name in caches else []
+    for cache in targets:
+        cache.clear()
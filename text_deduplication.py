@@ -1,26 +1,7 @@
 import os
 import re
-import difflib
 from datetime import datetime
-
-def calculate_similarity(text1, text2):
-    """计算两个文本的相似度，更准确地处理结构化内容"""
-    # 预处理文本，移除标题标记，确保标题内容不影响相似度计算
-    def preprocess(text):
-        # 移除Markdown标题标记
-        text = re.sub(r'^#+\s+', '', text, flags=re.MULTILINE)
-        # 移除其他格式标记
-        text = re.sub(r'^===\s*|\s*===$', '', text, flags=re.MULTILINE)
-        # 移除多余空白
-        text = re.sub(r'\s+', ' ', text).strip()
-        return text
-    
-    # 对两段文本进行预处理
-    processed_text1 = preprocess(text1)
-    processed_text2 = preprocess(text2)
-    
-    # 使用SequenceMatcher计算相似度
-    return difflib.SequenceMatcher(None, processed_text1, processed_text2).ratio()
+from near_duplicates import find_near_duplicates, DEDUP_THRESHOLD
 
 def extract_content_from_file(file_path):
     """从文件中提取标题和正文内容，兼容多种格式"""
@@ -41,8 +22,12 @@ def extract_content_from_file(file_path):
         print(f"读取文件失败 {file_path}: {e}")
         return None, None
 
-def deduplicate_knowledge_base(knowledge_dir="knowledge", similarity_threshold=0.85):
-    """去重知识库，保留最新版本的内容，增强对Markdown风格标题的支持"""
+def deduplicate_knowledge_base(knowledge_dir="knowledge", similarity_threshold=None):
+    """去重知识库，保留最新版本的内容，增强对Markdown风格标题的支持
+
+    只在标题相同的文件组内去重，组内用MinHash/LSH找出候选后精确计算shingle集合的Jaccard相似度，
+    similarity_threshold默认为DEDUP_THRESHOLD。
+    """
     if not os.path.exists(knowledge_dir):
         print(f"知识库目录不存在: {knowledge_dir}")
         return
@@ -54,59 +39,39 @@ def deduplicate_knowledge_base(knowledge_dir="knowledge", similarity_threshold=0
     
     print(f"开始处理 {len(files)} 个知识库文件...")
     
-    # 用于存储文件信息和内容
-    file_info = []
+    # 按标题对文件进行分组，只记录文件名和修改时间，内容在比较时按需读取
+    title_groups = {}
+    mtimes = {}
     for file in files:
         file_path = os.path.join(knowledge_dir, file)
         title, content = extract_content_from_file(file_path)
         if title and content:
-            # 提取文件修改时间
-            mtime = os.path.getmtime(file_path)
-            # 计算内容哈希，用于快速比较完全相同的文件
-            content_hash = hash(content)
-            file_info.append({
-                'file': file,
-                'path': file_path,
-                'title': title,
-                'content': content,
-                'mtime': mtime,
-                'hash': content_hash
-            })
+            # 简化标题，用于分组
+            simplified_title = re.sub(r'_\d{8}_\d{6}$', '', title.split('_')[0])
+            title_groups.setdefault(simplified_title, []).append(file)
+            # 按文件修改时间保留最新的版本
+            mtimes[file] = os.path.getmtime(file_path)
     
-    # 按标题对文件进行分组
-    title_groups = {}
-    for info in file_info:
-        # 简化标题，用于分组
-        simplified_title = re.sub(r'_\d{8}_\d{6}$', '', info['title'].split('_')[0])
-        if simplified_title not in title_groups:
-            title_groups[simplified_title] = []
-        title_groups[simplified_title].append(info)
+    def load_text(file):
+        title, content = extract_content_from_file(os.path.join(knowledge_dir, file))
+        return content or ""
     
     # 对每个标题组进行去重
     files_to_remove = []
     for title, group in title_groups.items():
-        if len(group) > 1:
-            print(f"\n发现重复标题组: {title} ({len(group)}个文件)")
-            # 按修改时间排序，保留最新的
-            group.sort(key=lambda x: x['mtime'], reverse=True)
-            
-            # 比较第一个文件（最新的）与其他文件的相似度
-            latest = group[0]
-            print(f"  保留最新文件: {latest['file']} (修改时间: {datetime.fromtimestamp(latest['mtime']).strftime('%Y-%m-%d %H:%M:%S')})")
-            
-            for other in group[1:]:
-                # 首先检查哈希值是否相同
-                if latest['hash'] == other['hash']:
-                    print(f"  完全重复文件: {other['file']} - 标记删除")
-                    files_to_remove.append(other['path'])
+        if len(group) < 2:
+            continue
+        for latest, duplicates in find_near_duplicates(group, load_text, mtimes, similarity_threshold):
+            print(f"\n发现重复标题组: {title} ({len(duplicates) + 1}个文件)")
+            print(f"  保留最新文件: {latest} (修改时间: {datetime.fromtimestamp(mtimes[latest]).strftime('%Y-%m-%d %H:%M:%S')})")
+            latest_content = load_text(latest)
+            for other, similarity in duplicates:
+                # shingle集合相同不代表内容相同（空白和标题标记已去除），只有原文相同才是完全重复
+                if load_text(other) == latest_content:
+                    print(f"  完全重复文件: {other} - 标记删除")
                 else:
-                    # 计算相似度
-                    similarity = calculate_similarity(latest['content'], other['content'])
-                    if similarity >= similarity_threshold:
-                        print(f"  高相似文件: {other['file']} (相似度: {similarity:.2f}) - 标记删除")
-                        files_to_remove.append(other['path'])
-                    else:
-                        print(f"  低相似文件: {other['file']} (相似度: {similarity:.2f}) - 保留")
+                    print(f"  高相似文件: {other} (相似度: {similarity:.2f}) - 标记删除")
+                files_to_remove.append(os.path.join(knowledge_dir, other))
     
     # 执行删除操作
     if files_to_remove:
@@ -125,8 +90,8 @@ def deduplicate_knowledge_base(knowledge_dir="knowledge", similarity_threshold=0
 def main():
     """主函数"""
     knowledge_dir = "knowledge"
-    # 可调整相似度阈值，值越高越严格，只删除非常相似的文件
-    similarity_threshold = 0.85
+    # 可调整相似度阈值（5字shingle集合的Jaccard相似度），值越高越严格，只删除非常相似的文件
+    similarity_threshold = DEDUP_THRESHOLD
     deduplicate_knowledge_base(knowledge_dir, similarity_threshold)
 
 if __name__ == "__main__":
@@ -158,31 +123,25 @@ def read_file_content(file_path):
         print(f"读取文件失败 {file_path}: {e}")
         return None
 
-def calculate_similarity(text1, text2):
-    """计算两个文本的相似度"""
-    # 提取正文内容进行比较
-    content1 = re.search(r'=== 正文内容 ===(.+)', text1, re.DOTALL)
-    content2 = re.search(r'=== 正文内容 ===(.+)', text2, re.DOTALL)
-    
-    if content1 and content2:
-        text1 = content1.group(1).strip()
-        text2 = content2.group(1).strip()
-    
-    # 使用difflib计算相似度
-    return difflib.SequenceMatcher(None, text1, text2).ratio()
+def extract_body(text):
+    """提取正文内容，没有正文分隔行时返回原文"""
+    content = re.search(r'=== 正文内容 ===(.+)', text, re.DOTALL)
+    return content.group(1).strip() if content else text
+
+def detect_duplicate_texts(folder_path, similarity_threshold=None):
+    """检测相似文本，返回 ([[最新文件, 重复文件, ...], ...], 文件时间)
 
-def detect_duplicate_texts(folder_path, similarity_threshold=0.8):
-    """检测相似文本"""
+    用MinHash/LSH找出候选文件对，只对候选对精确计算正文shingle集合的Jaccard相似度，
+    similarity_threshold默认为DEDUP_THRESHOLD。
+    """
     files = [f for f in os.listdir(folder_path) if f.endswith('.txt')]
-    file_contents = {}
     file_times = {}
     
-    # 读取所有文件内容和时间信息
+    # 读取时间信息，文件内容在检测时按需读取，不全部保存在内存中
     for file in files:
         file_path = os.path.join(folder_path, file)
         content = read_file_content(file_path)
         if content:
-            file_contents[file] = content
             # 优先使用提取时间，如果没有则使用文件修改时间
             extract_time = get_extraction_time(content)
             if extract_time:
@@ -190,29 +149,17 @@ def detect_duplicate_texts(folder_path, similarity_threshold=0.8):
             else:
                 file_times[file] = get_file_modification_time(file_path)
     
-    # 检测相似文件组
-    duplicate_groups = []
-    processed = set()
+    def load_text(file):
+        return extract_body(read_file_content(os.path.join(folder_path, file)) or "")
     
-    for i, file1 in enumerate(files):
-        if file1 in processed:
-            continue
-        group = [file1]
-        processed.add(file1)
-        
-        for j, file2 in enumerate(files):
-            if i != j and file2 not in processed:
-                similarity = calculate_similarity(file_contents[file1], file_contents[file2])
-                if similarity >= similarity_threshold:
-                    group.append(file2)
-                    processed.add(file2)
-        
-        if len(group) > 1:
-            duplicate_groups.append(group)
+    # 检测相似文件组，每组第一个为最新的文件
+    duplicate_groups = []
+    for latest, duplicates in find_near_duplicates(list(file_times), load_text, file_times, similarity_threshold):
+        duplicate_groups.append([latest] + [file for file, similarity in duplicates])
     
     return duplicate_groups, file_times
 
-def deduplicate_texts(folder_path, similarity_threshold=0.8):
+def deduplicate_texts(folder_path, similarity_threshold=None):
     """自动去重，保留最新版本"""
     duplicate_groups, file_times = detect_duplicate_texts(folder_path, similarity_threshold)
     deleted_files = []
@@ -0,0 +1,579 @@
+import os
+import json
+import pickle
+import shutil
+import threading
+import numpy as np
+
+# 向量库后端：chroma 为ChromaDB（默认），numpy 为进程内的NumPy矩阵索引
+VECTOR_BACKENDS = ('chroma', 'numpy')
+VECTOR_BACKEND = os.environ.get('VECTOR_BACKEND', 'chroma')
+
+# 默认的向量库路径，NumPy后端的数据存放在其下的numpy_store目录
+DB_PATH = "db/chroma_demo"
+
+# 向量数超过该值时训练IVF粗量化器，查询时只搜索与查询最接近的若干个聚类
+IVF_MIN_SIZE = int(os.environ.get('IVF_MIN_SIZE', '10000'))
+# 每次查询搜索的聚类数
+IVF_NPROBE = int(os.environ.get('IVF_NPROBE', '8'))
+# 训练后向量数增长超过该倍数时重新训练
+IVF_RETRAIN_FACTOR = 4
+KMEANS_ITERATIONS = 10
+
+# NumPy后端的向量存储精度：float32（默认）、float16（半精度）、int8（按维度的标量量化）
+VECTOR_DTYPES = ('float32', 'float16', 'int8')
+VECTOR_DTYPE = os.environ.get('VECTOR_DTYPE', 'float32')
+# 入库时拟合PCA降维到的维度，0表示不降维
+VECTOR_PCA_DIM = int(os.environ.get('VECTOR_PCA_DIM', '0'))
+# 向量数达到该值后才拟合压缩参数（PCA和量化范围），之前以float32原样存储
+CODEC_MIN_SIZE = int(os.environ.get('VECTOR_CODEC_MIN_SIZE', '1000'))
+# 拟合压缩参数时最多使用的样本数
+CODEC_SAMPLE_SIZE = 50000
+# 压缩存储的矩阵分块转换为float32后计算内积，块较小时转换结果留在CPU缓存中
+SCORE_BLOCK_ROWS = 256
+
+# 进程内共享的Chroma客户端
+chroma_clients = {}
+chroma_lock = threading.Lock()
+
+# 进程内共享的NumPy集合（按存储目录），同一进程中打开同一集合的各处看到相同的数据
+numpy_collections = {}
+numpy_lock = threading.Lock()
+
+def get_chroma_client(path=DB_PATH):
+    """获取共享的Chroma客户端"""
+    import chromadb
+    with chroma_lock:
+        if path not in chroma_clients:
+            chroma_clients[path] = chromadb.PersistentClient(path=path)
+        return chroma_clients[path]
+
+def numpy_store_dir(name, path=DB_PATH):
+    """NumPy后端中集合的存储目录"""
+    return os.path.join(path, 'numpy_store', name)
+
+def get_collection(name, path=DB_PATH, backend=None, create=True):
+    """打开集合，create为True时不存在则创建；返回的对象提供与Chroma集合相同的常用方法
+    （get、upsert、update、delete、query、count）"""
+    backend = backend or VECTOR_BACKEND
+    if backend not in VECTOR_BACKENDS:
+        raise ValueError(f"不支持的向量库后端: {backend}，可选: {', '.join(VECTOR_BACKENDS)}")
+    if backend == 'numpy':
+        directory = numpy_store_dir(name, path)
+        key = os.path.abspath(directory)
+        with numpy_lock:
+            if key not in numpy_collections:
+                if not create and not os.path.exists(directory):
+                    raise ValueError(f"集合不存在: {name}")
+                numpy_collections[key] = NumpyCollection(name, directory)
+            return numpy_collections[key]
+    client = get_chroma_client(path)
+    if create:
+        return client.get_or_create_collection(name=name)
+    return client.get_collection(name=name)
+
+def delete_collection(name, path=DB_PATH, backend=None):
+    """删除集合，集合不存在时忽略"""
+    backend = backend or VECTOR_BACKEND
+    if backend == 'numpy':
+        directory = numpy_store_dir(name, path)
+        with numpy_lock:
+            numpy_collections.pop(os.path.abspath(directory), None)
+            shutil.rmtree(directory, ignore_errors=True)
+        return
+    try:
+        get_chroma_client(path).delete_collection(name)
+    except Exception:
+        pass  # 集合可能不存在，忽略错误
+
+def flush(collection):
+    """将集合的写入整理落盘（NumPy后端合并日志并重建索引，Chroma后端无需处理）"""
+    if isinstance(collection, NumpyCollection):
+        collection.persist()
+
+def normalize_rows(vectors):
+    """按行做L2归一化，返回float32矩阵"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def match_where(metadata, where):
+    """判断元数据是否满足Chroma风格的过滤条件（支持等值、$eq、$ne、$in、$nin、$and、$or）"""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == '$and':
+            if not all(match_where(metadata, sub) for sub in condition):
+                return False
+        elif key == '$or':
+            if not any(match_where(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, operand in condition.items():
+                if op == '$eq' and value != operand:
+                    return False
+                if op == '$ne' and value == operand:
+                    return False
+                if op == '$in' and value not in operand:
+                    return False
+                if op == '$nin' and value in operand:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+def top_k_indices(scores, k):
+    """返回得分最高的k个位置（按得分从高到低），只对前k个结果排序"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind='stable')]
+
+def train_kmeans(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """球面k-means：返回归一化的聚类中心 (nlist × 维度)"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        empty = np.bincount(assignments, minlength=nlist) == 0
+        # 空聚类重新随机取一个向量作为中心
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+def fit_codec(vectors, dtype, pca_dim=0, seed=0):
+    """在已入库的向量上拟合压缩参数：可选的PCA投影（均值和主成分），int8量化时为每一维的取值范围"""
+    sample = vectors
+    if len(vectors) > CODEC_SAMPLE_SIZE:
+        sample = vectors[np.sort(np.random.default_rng(seed).choice(len(vectors), CODEC_SAMPLE_SIZE, replace=False))]
+    sample = np.asarray(sample, dtype=np.float32)
+    codec = {'dtype': dtype, 'mean': None, 'components': None, 'lo': None, 'scale': None}
+    if pca_dim and pca_dim < sample.shape[1]:
+        # 协方差矩阵的特征分解，取方差最大的pca_dim个方向
+        mean = sample.mean(axis=0)
+        centered = sample - mean
+        eigenvalues, eigenvectors = np.linalg.eigh(centered.T @ centered / len(sample))
+        order = np.argsort(eigenvalues)[::-1]
+        codec['mean'] = mean
+        codec['components'] = np.ascontiguousarray(eigenvectors[:, order[:pca_dim]].T, dtype=np.float32)
+        explained = eigenvalues[order[:pca_dim]].sum() / max(eigenvalues.sum(), 1e-12)
+        print(f"PCA降维: {sample.shape[1]} -> {pca_dim} 维，保留方差 {explained:.1%}")
+        sample = project_vectors(codec, sample)
+    if dtype == 'int8':
+        lo = sample.min(axis=0)
+        codec['lo'] = lo
+        codec['scale'] = np.maximum(sample.max(axis=0) - lo, 1e-12) / 255
+    return codec
+
+def project_vectors(codec, vectors):
+    """入库向量投影到PCA空间（减去均值后乘主成分），未降维时原样返回"""
+    if codec is None or codec['components'] is None:
+        return vectors
+    return (vectors - codec['mean']) @ codec['components'].T
+
+def project_queries(codec, queries):
+    """查询向量投影到PCA空间（不减均值，与均值的内积作为偏移单独计算）"""
+    if codec is None or codec['components'] is None:
+        return queries
+    return queries @ codec['components'].T
+
+def encode_vectors(codec, vectors):
+    """归一化的向量转换为存储格式：PCA投影后按存储精度转换，int8为每一维 [最小值, 最大值] 映射到 [-128, 127]"""
+    if codec is None:
+        return vectors
+    if codec['components'] is not None and vectors.shape[1] != codec['components'].shape[1]:
+        raise ValueError(f"向量维度不一致: 集合为 {codec['components'].shape[1]}，写入为 {vectors.shape[1]}")
+    projected = project_vectors(codec, vectors)
+    if codec['dtype'] == 'int8':
+        codes = np.clip(np.rint((projected - codec['lo']) / codec['scale']), 0, 255) - 128
+        return codes.astype(np.int8)
+    return projected.astype(np.float16 if codec['dtype'] == 'float16' else np.float32)
+
+def decode_vectors(codec, codes):
+    """存储格式转换回float32（仍在PCA空间中）"""
+    if codec is not None and codec['dtype'] == 'int8':
+        return codec['lo'] + codec['scale'] * (np.asarray(codes, dtype=np.float32) + 128)
+    return np.asarray(codes, dtype=np.float32)
+
+def reconstruct_vectors(codec, codes):
+    """存储格式还原为原始维度的近似向量"""
+    vectors = decode_vectors(codec, codes)
+    if codec is not None and codec['components'] is not None:
+        vectors = vectors @ codec['components'] + codec['mean']
+    return vectors
+
+def query_weights(codec, queries):
+    """把查询转换为直接与存储格式做内积的权重：相似度 = 存储的行 · 权重 + 偏移"""
+    projected = project_queries(codec, queries)
+    biases = np.zeros(len(queries), dtype=np.float32)
+    if codec is None:
+        return projected, biases
+    if codec['components'] is not None:
+        biases = queries @ codec['mean']
+    if codec['dtype'] == 'int8':
+        # x ≈ lo + scale * (code + 128)，展开后与code无关的部分并入偏移
+        biases = biases + projected @ (codec['lo'] + 128 * codec['scale'])
+        return (projected * codec['scale']).astype(np.float32), biases
+    return projected.astype(np.float32), biases
+
+def score_rows(matrix, weights, biases):
+    """存储矩阵与查询权重的内积 (查询数 × 行数)，压缩存储时分块转换为float32计算"""
+    if matrix.dtype == np.float32:
+        return weights @ matrix.T + biases[:, None]
+    scores = np.empty((len(weights), len(matrix)), dtype=np.float32)
+    buffer = np.empty((SCORE_BLOCK_ROWS, matrix.shape[1]), dtype=np.float32)
+    for start in range(0, len(matrix), SCORE_BLOCK_ROWS):
+        block = buffer[:min(SCORE_BLOCK_ROWS, len(matrix) - start)]
+        block[...] = matrix[start:start + len(block)]
+        scores[:, start:start + len(block)] = weights @ block.T
+    return scores + biases[:, None]
+
+class NumpyCollection:
+    """NumPy向量集合：归一化的向量矩阵 + 文档和元数据，内积即余弦相似度
+
+    写入先追加到操作日志（逐批落盘），persist()时合并为新一代的vectors.<代>.npy、records.<代>.pkl、
+    ivf.<代>.npz和codec.<代>.pkl，写完后原子替换CURRENT文件切换到新一代；加载时向量矩阵以内存映射方式打开。
+    存储精度和PCA维度在创建集合时写入config.json，向量数达到CODEC_MIN_SIZE后的首次合并时拟合压缩参数，
+    之后写入的向量按同一参数压缩。
+    """
+
+    def __init__(self, name, directory, dtype=None, pca_dim=None):
+        self.name = name
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+        self.index = {}
+        self.matrix = None  # 容量可能大于行数，有效行为 matrix[:len(ids)]
+        self.centroids = None
+        self.assignments = None
+        self.ivf_trained_size = 0
+        self.ivf_lists = None
+        self.generation = 0
+        self.codec = None  # 未拟合压缩参数时向量以float32原样存储
+        os.makedirs(directory, exist_ok=True)
+        self.dtype, self.pca_dim = self.load_config(dtype, pca_dim)
+        self.load()
+
+    # 存储
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def load_config(self, dtype, pca_dim):
+        """读取集合的存储配置，新集合按参数或环境变量创建配置"""
+        if os.path.exists(self.path('config.json')):
+            with open(self.path('config.json'), encoding='utf-8') as fp:
+                config = json.load(fp)
+            return config['dtype'], config['pca_dim']
+        dtype = dtype or VECTOR_DTYPE
+        pca_dim = VECTOR_PCA_DIM if pca_dim is None else pca_dim
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"不支持的向量存储精度: {dtype}，可选: {', '.join(VECTOR_DTYPES)}")
+        with open(self.path('config.json'), 'w', encoding='utf-8') as fp:
+            json.dump({'dtype': dtype, 'pca_dim': pca_dim}, fp)
+        return dtype, pca_dim
+
+    def load(self):
+        """加载当前一代的合并数据，再重放操作日志"""
+        if os.path.exists(self.path('CURRENT')):
+            with open(self.path('CURRENT'), encoding='utf-8') as fp:
+                self.generation = int(fp.read().strip())
+            gen = self.generation
+            with open(self.path(f'records.{gen}.pkl'), 'rb') as fp:
+                records = pickle.load(fp)
+            self.ids = records['ids']
+            self.documents = records['documents']
+            self.metadatas = records['metadatas']
+            self.index = {doc_id: row for row, doc_id in enumerate(self.ids)}
+            if self.ids:
+                self.matrix = np.load(self.path(f'vectors.{gen}.npy'), mmap_mode='r')
+            if os.path.exists(self.path(f'codec.{gen}.pkl')):
+                with open(self.path(f'codec.{gen}.pkl'), 'rb') as fp:
+                    self.codec = pickle.load(fp)
+            if os.path.exists(self.path(f'ivf.{gen}.npz')):
+                ivf = np.load(self.path(f'ivf.{gen}.npz'))
+                self.centroids = ivf['centroids']
+                self.assignments = ivf['assignments']
+                self.ivf_trained_size = int(ivf['trained_size'])
+        if os.path.exists(self.path('log.pkl')):
+            with open(self.path('log.pkl'), 'rb') as fp:
+                while True:
+                    try:
+                        op, args = pickle.load(fp)
+                    except (EOFError, pickle.UnpicklingError):
+                        break  # 中断时最后一条日志可能不完整
+                    getattr(self, f"apply_{op}")(*args)
+
+    def append_log(self, op, args):
+        """追加一条操作日志并落盘"""
+        with open(self.path('log.pkl'), 'ab') as fp:
+            pickle.dump((op, args), fp, protocol=pickle.HIGHEST_PROTOCOL)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def persist(self):
+        """合并操作日志：写入新一代的数据文件后原子切换CURRENT，再删除旧文件和日志
+
+        切换前中断时仍使用旧一代数据并重放日志；切换后、删除日志前中断时日志会被重放一次，
+        写入、更新和删除都是幂等的，结果不变。
+        """
+        with self.lock:
+            size = len(self.ids)
+            if self.codec is None and (self.dtype != 'float32' or self.pca_dim) and size >= max(CODEC_MIN_SIZE, self.pca_dim + 1):
+                self.compress()
+            if size >= IVF_MIN_SIZE and (self.centroids is None or size > self.ivf_trained_size * IVF_RETRAIN_FACTOR):
+                self.build_ivf()
+            gen = self.generation + 1
+            if size:
+                np.save(self.path(f'vectors.{gen}.npy'), np.asarray(self.matrix[:size]))
+            with open(self.path(f'records.{gen}.pkl'), 'wb') as fp:
+                pickle.dump({'ids': self.ids, 'documents': self.documents, 'metadatas': self.metadatas},
+                            fp, protocol=pickle.HIGHEST_PROTOCOL)
+            if self.centroids is not None:
+                np.savez(self.path(f'ivf.{gen}.npz'), centroids=self.centroids, assignments=self.assignments[:size],
+                         trained_size=self.ivf_trained_size)
+            if self.codec is not None:
+                with open(self.path(f'codec.{gen}.pkl'), 'wb') as fp:
+                    pickle.dump(self.codec, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            with open(self.path('CURRENT.tmp'), 'w', encoding='utf-8') as fp:
+                fp.write(str(gen))
+            os.replace(self.path('CURRENT.tmp'), self.path('CURRENT'))
+            self.generation = gen
+
+            # 删除旧一代的文件和已合并的日志
+            for filename in os.listdir(self.directory):
+                parts = filename.split('.')
+                if len(parts) == 3 and parts[1].isdigit() and int(parts[1]) != gen:
+                    try:
+                        os.remove(self.path(filename))
+                    except OSError:
+                        pass  # 文件仍被内存映射占用时（Windows）留到下次合并再删除
+            if os.path.exists(self.path('log.pkl')):
+                os.remove(self.path('log.pkl'))
+            # 重新以内存映射方式打开
+            self.matrix = np.load(self.path(f'vectors.{gen}.npy'), mmap_mode='r') if size else None
+
+    def compress(self):
+        """在已有向量上拟合压缩参数，把矩阵转换为存储格式；向量空间改变后IVF需重新训练"""
+        size = len(self.ids)
+        vectors = self.matrix[:size]
+        self.codec = fit_codec(vectors, self.dtype, self.pca_dim)
+        components = self.codec['components']
+        encoded = np.empty((size, len(components) if components is not None else vectors.shape[1]), dtype=self.dtype)
+        for start in range(0, size, 65536):
+            encoded[start:start + 65536] = encode_vectors(self.codec, np.asarray(vectors[start:start + 65536]))
+        print(f"向量压缩完成: {size} 个向量，{vectors.nbytes / 1e6:.1f} MB -> {encoded.nbytes / 1e6:.1f} MB")
+        self.matrix = encoded
+        self.centroids = None
+        self.assignments = None
+        self.ivf_trained_size = 0
+        self.ivf_lists = None
+
+    # 写入
+    def ensure_capacity(self, rows, dim, dtype):
+        """保证矩阵可再容纳rows行，容量不足时按倍数扩容（内存映射的矩阵在首次写入时复制到内存）"""
+        size = len(self.ids)
+        if self.matrix is None:
+            self.matrix = np.empty((max(rows, 1024), dim), dtype=dtype)
+        elif self.matrix.shape[1] != dim:
+            raise ValueError(f"向量维度不一致: 集合为 {self.matrix.shape[1]}，写入为 {dim}")
+        elif isinstance(self.matrix, np.memmap) or size + rows > len(self.matrix):
+            grown = np.empty((max(size + rows, len(self.matrix) * 2), dim), dtype=self.matrix.dtype)
+            grown[:size] = self.matrix[:size]
+            self.matrix = grown
+
+    def apply_upsert(self, ids, vectors, documents, metadatas):
+        encoded = encode_vectors(self.codec, vectors)
+        for i, doc_id in enumerate(ids):
+            row = self.index.get(doc_id)
+            if row is None:
+                self.ensure_capacity(1, encoded.shape[1], encoded.dtype)
+                row = len(self.ids)
+                self.index[doc_id] = row
+                self.ids.append(doc_id)
+                self.documents.append(None)
+                self.metadatas.append(None)
+            elif isinstance(self.matrix, np.memmap):
+                self.ensure_capacity(0, encoded.shape[1], encoded.dtype)
+            self.matrix[row] = encoded[i]
+            self.documents[row] = documents[i] if documents is not None else self.documents[row]
+            self.metadatas[row] = metadatas[i] if metadatas is not None else self.metadatas[row]
+        if self.centroids is not None:
+            if len(self.assignments) < len(self.ids):
+                self.assignments = np.concatenate([self.assignments, np.zeros(len(self.ids) - len(self.assignments), dtype=np.int32)])
+            rows = [self.index[doc_id] for doc_id in ids]
+            self.assignments[rows] = np.argmax(project_vectors(self.codec, vectors) @ self.centroids.T, axis=1)
+        self.ivf_lists = None
+
+    def apply_update(self, ids, documents, metadatas):
+        for i, doc_id in enumerate(ids):
+            row = self.index.get(doc_id)
+            if row is None:
+                continue
+            if documents is not None:
+                self.documents[row] = documents[i]
+            if metadatas is not None:
+                self.metadatas[row] = {**(self.metadatas[row] or {}), **metadatas[i]}
+
+    def apply_delete(self, ids):
+        rows = {self.index[doc_id] for doc_id in ids if doc_id in self.index}
+        if not rows:
+            return
+        keep = np.array([row for row in range(len(self.ids)) if row not in rows], dtype=np.int64)
+        self.matrix = np.ascontiguousarray(self.matrix[keep]) if len(keep) else None
+        self.ids = [self.ids[row] for row in keep]
+        self.documents = [self.documents[row] for row in keep]
+        self.metadatas = [self.metadatas[row] for row in keep]
+        self.index = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        if self.assignments is not None:
+            self.assignments = self.assignments[keep]
+        self.ivf_lists = None
+
+    def upsert(self, ids, embeddings=None, documents=None, metadatas=None):
+        """写入或覆盖向量、文档和元数据"""
+        vectors = normalize_rows(embeddings)
+        with self.lock:
+            self.append_log('upsert', (list(ids), vectors, documents, metadatas))
+            self.apply_upsert(list(ids), vectors, documents, metadatas)
+
+    add = upsert
+
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        """更新已有条目的元数据或文档"""
+        with self.lock:
+            if embeddings is not None:
+                existing = [self.index[doc_id] for doc_id in ids]
+                self.upsert(ids, embeddings,
+                            documents if documents is not None else [self.documents[row] for row in existing],
+                            metadatas if metadatas is not None else [self.metadatas[row] for row in existing])
+                return
+            self.append_log('update', (list(ids), documents, metadatas))
+            self.apply_update(list(ids), documents, metadatas)
+
+    def delete(self, ids=None, where=None):
+        """按ID或过滤条件删除条目"""
+        if ids is None and not where:
+            raise ValueError("删除条目需要指定ids或where")
+        with self.lock:
+            if ids is None:
+                ids = [doc_id for doc_id, metadata in zip(self.ids, self.metadatas) if match_where(metadata or {}, where)]
+            elif where:
+                ids = [doc_id for doc_id in ids if doc_id in self.index and match_where(self.metadatas[self.index[doc_id]] or {}, where)]
+            self.append_log('delete', (list(ids),))
+            self.apply_delete(list(ids))
+
+    # 读取
+    def count(self):
+        return len(self.ids)
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=('metadatas', 'documents')):
+        """按ID或过滤条件读取条目，返回与Chroma相同结构的字典"""
+        with self.lock:
+            if ids is not None:
+                rows = [self.index[doc_id] for doc_id in ids if doc_id in self.index]
+            else:
+                rows = range(len(self.ids))
+            rows = [row for row in rows if match_where(self.metadatas[row] or {}, where)]
+            rows = rows[offset or 0:]
+            if limit is not None:
+                rows = rows[:limit]
+            result = {'ids': [self.ids[row] for row in rows]}
+            result['metadatas'] = [self.metadatas[row] for row in rows] if 'metadatas' in include else None
+            result['documents'] = [self.documents[row] for row in rows] if 'documents' in include else None
+            result['embeddings'] = reconstruct_vectors(self.codec, self.matrix[rows]) if 'embeddings' in include and rows else None
+            return result
+
+    def build_ivf(self, nlist=None):
+        """训练IVF粗量化器：聚类中心数默认取 4 * sqrt(向量数)"""
+        with self.lock:
+            size = len(self.ids)
+            nlist = min(size, nlist or int(4 * np.sqrt(size)))
+            # 压缩存储时在PCA空间中聚类，分块解码避免整个矩阵转换为float32
+            vectors = self.matrix[:size]
+            sample = vectors
+            if size > nlist * 256:
+                sample = vectors[np.sort(np.random.default_rng(0).choice(size, nlist * 256, replace=False))]
+            self.centroids = train_kmeans(normalize_rows(decode_vectors(self.codec, sample)), nlist)
+            self.assignments = np.empty(size, dtype=np.int32)
+            for start in range(0, size, 65536):
+                block = decode_vectors(self.codec, vectors[start:start + 65536])
+                self.assignments[start:start + 65536] = np.argmax(block @ self.centroids.T, axis=1)
+            self.ivf_trained_size = size
+            self.ivf_lists = None
+            print(f"IVF索引训练完成: {nlist} 个聚类，{size} 个向量")
+
+    def get_ivf_lists(self):
+        """各聚类包含的行号 (按聚类排序的行号, 每个聚类的起始位置)"""
+        if self.ivf_lists is None:
+            order = np.argsort(self.assignments, kind='stable')
+            offsets = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+            self.ivf_lists = (order, offsets)
+        return self.ivf_lists
+
+    def snapshot(self):
+        """取当前数据的一致视图，查询在视图上进行，不阻塞其他线程的查询"""
+        with self.lock:
+            size = len(self.ids)
+            ivf = None
+            if self.centroids is not None and size:
+                ivf = (self.centroids, self.get_ivf_lists())
+            return {
+                'matrix': self.matrix[:size] if size else None,
+                'ids': self.ids[:size],
+                'documents': self.documents[:size],
+                'metadatas': self.metadatas[:size],
+                'codec': self.codec,
+                'ivf': ivf
+            }
+
+    def search(self, state, queries, k, where=None, nprobe=IVF_NPROBE, exact=False):
+        """近邻搜索：返回每个查询的 [(行号, 余弦相似度), ...]"""
+        matrix = state['matrix']
+        if matrix is None:
+            return [[] for _ in range(len(queries))]
+        allowed = None
+        if where:
+            allowed = np.array([match_where(metadata or {}, where) for metadata in state['metadatas']])
+        results = []
+        codec = state['codec']
+        weights, biases = query_weights(codec, queries)
+        if exact or state['ivf'] is None:
+            # 精确搜索：整批查询与矩阵做一次矩阵乘法
+            scores = score_rows(matrix, weights, biases)
+            if allowed is not None:
+                scores[:, ~allowed] = -np.inf
+            for row_scores in scores:
+                top = top_k_indices(row_scores, k)
+                results.append([(int(row), float(row_scores[row])) for row in top if np.isfinite(row_scores[row])])
+            return results
+        centroids, (order, offsets) = state['ivf']
+        centroid_scores = project_queries(codec, queries) @ centroids.T
+        for weight, bias, row_scores in zip(weights, biases, centroid_scores):
+            probes = top_k_indices(row_scores, nprobe)
+            candidates = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probes])
+            if allowed is not None:
+                candidates = candidates[allowed[candidates]]
+            scores = np.asarray(matrix[candidates], dtype=np.float32) @ weight + bias
+            top = top_k_indices(scores, k)
+            results.append([(int(candidates[i]), float(scores[i])) for i in top])
+        return results
+
+    def query(self, query_embeddings, n_results=10, where=None, include=('metadatas', 'documents', 'distances'), exact=False):
+        """近邻搜索，返回与Chroma相同结构的字典，distances为余弦距离 (1 - 余弦相似度)"""
+        queries = normalize_rows(query_embeddings)
+        state = self.snapshot()
+        hits = self.search(state, queries, n_results, where, exact=exact)
+        return {
+            'ids': [[state['ids'][row] for row, score in rows] for rows in hits],
+            'documents': [[state['documents'][row] for row, score in rows] for rows in hits],
+            'metadatas': [[state['metadatas'][row] for row, score in rows] for rows in hits],
+            'distances': [[1.0 - score for row, score in rows] for rows in hits]
+        }